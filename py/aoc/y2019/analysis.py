@@ -0,0 +1,288 @@
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import pytest
+
+from .computer import IntComputer, Instruction, Opcode, Mode, PARAMETERS, WRITTEN
+from .utils import read_csv_input
+
+JUMPS = (Opcode.JUMP_IF_TRUE, Opcode.JUMP_IF_FALSE)
+FOLDED = {
+    Opcode.ADD: lambda a, b: a + b,
+    Opcode.MULTIPLY: lambda a, b: a * b,
+    Opcode.LESS_THAN: lambda a, b: int(a < b),
+    Opcode.EQUALS: lambda a, b: int(a == b),
+}
+
+class Operation(NamedTuple):
+    address: int
+    opcode: Opcode
+    modes: Tuple[Mode, ...]
+    parameters: Tuple[int, ...]
+
+    @property
+    def size(self) -> int:
+        return 1 + len(self.parameters)
+
+    @property
+    def cells(self) -> range:
+        return range(self.address, self.address + self.size)
+
+    def encode(self) -> List[int]:
+        instruction = int(self.opcode) + sum(int(mode) * 10 ** (2 + index) for index, mode in enumerate(self.modes))
+        return [instruction, *self.parameters]
+
+    def __str__(self) -> str:
+        operands = ' '.join(
+            str(parameter) if mode == Mode.IMMEDIATE else
+            f'[{parameter}]' if mode == Mode.POSITION else f'[base{parameter:+}]'
+            for parameter, mode in zip(self.parameters, self.modes))
+        return f'{self.address:>6} {self.opcode.name:<20} {operands}'
+
+def decode(program: Sequence[int], address: int) -> Optional[Operation]:
+    # The operation at address, None where the value is not an instruction
+    # or its parameters run past the end of the program.
+    try:
+        opcode, modes = Instruction.decode(program[address])
+    except (ValueError, IndexError):
+        return None
+    count = PARAMETERS[opcode]
+    if address + count >= len(program):
+        return None
+    return Operation(address, opcode, modes[:count], tuple(program[address + 1:address + 1 + count]))
+
+def static_value(program: Sequence[int], operation: Operation, offset: int) -> Optional[int]:
+    # The value of an input parameter as far as it is known from the image,
+    # None for relative parameters and addresses outside of the program.
+    parameter, mode = operation.parameters[offset], operation.modes[offset]
+    if mode == Mode.IMMEDIATE:
+        return parameter
+    if mode == Mode.POSITION and 0 <= parameter < len(program):
+        return program[parameter]
+    return None
+
+def successors(program: Sequence[int], operation: Operation) -> Tuple[List[int], bool]:
+    # Where execution goes after operation, and whether that is only known
+    # at run time. A jump with a constant condition has one way out.
+    end = operation.address + operation.size
+    if operation.opcode == Opcode.HALT:
+        return [], False
+    if operation.opcode not in JUMPS:
+        return [end], False
+    condition = operation.parameters[0] if operation.modes[0] == Mode.IMMEDIATE else None
+    target = static_value(program, operation, 1)
+    taken = None if condition is None else bool(condition) == (operation.opcode == Opcode.JUMP_IF_TRUE)
+    addresses = [] if taken else [end]
+    if taken is not False:
+        if target is None:
+            return addresses, True
+        addresses.append(target)
+    return addresses, False
+
+def disassemble(program: Sequence[int], entry: int = 0) -> Dict[int, Operation]:
+    # Every operation reachable from entry, assuming the program is run as
+    # it is, see analyze() for when that holds. Paths that reach a value
+    # that is not an instruction end there, the program fails on it.
+    operations = {}
+    pending = [entry]
+    while pending:
+        address = pending.pop()
+        if address in operations or not 0 <= address < len(program):
+            continue
+        operation = decode(program, address)
+        if operation is None:
+            continue
+        operations[address] = operation
+        pending.extend(successors(program, operation)[0])
+    return operations
+
+def listing(program: Sequence[int]) -> str:
+    operations = disassemble(program)
+    return '\n'.join(str(operations[address]) for address in sorted(operations))
+
+@dataclass
+class BasicBlock:
+    start: int
+    operations: List[Operation] = field(default_factory=list)
+    successors: List[int] = field(default_factory=list)
+    indirect: bool = False
+
+def control_flow_graph(program: Sequence[int], operations: Dict[int, Operation]) -> Dict[int, BasicBlock]:
+    # Blocks start at the entry, at jump targets and after jumps, and end
+    # with a jump, a halt or right before the next block.
+    leaders = {0}
+    for operation in operations.values():
+        if operation.opcode in JUMPS:
+            leaders.add(operation.address + operation.size)
+            leaders.update(successors(program, operation)[0])
+    blocks = {}
+    for start in sorted(leaders & operations.keys()):
+        block = blocks[start] = BasicBlock(start)
+        address = start
+        while True:
+            operation = operations[address]
+            block.operations.append(operation)
+            block.successors, block.indirect = successors(program, operation)
+            address += operation.size
+            if operation.opcode in JUMPS or operation.opcode == Opcode.HALT or address in leaders:
+                break
+            if address not in operations:
+                # the next value is not an instruction
+                block.successors = []
+                break
+    return blocks
+
+class Analysis(NamedTuple):
+    operations: Dict[int, Operation]
+    blocks: Dict[int, BasicBlock]
+    # None when some address is only known at run time
+    written: Optional[FrozenSet[int]]
+    read: Optional[FrozenSet[int]]
+    # the cells of reachable operations that nothing ever writes to
+    frozen: FrozenSet[int]
+
+def analyze(program: Sequence[int]) -> Analysis:
+    # The disassembly follows the values in the image. That is only what
+    # runs if no reachable operation gets written to, and otherwise nothing
+    # is frozen. Relative parameters and jumps through memory that gets
+    # written make the addresses unknown, and nothing is frozen either.
+    operations = disassemble(program)
+    blocks = control_flow_graph(program, operations)
+    written: Optional[Set[int]] = set()
+    read: Optional[Set[int]] = set()
+    for operation in operations.values():
+        for offset, (parameter, mode) in enumerate(zip(operation.parameters, operation.modes), 1):
+            if mode == Mode.IMMEDIATE:
+                continue
+            if mode == Mode.RELATIVE:
+                written = read = None
+                break
+            if offset == WRITTEN.get(operation.opcode):
+                written.add(parameter)
+            else:
+                read.add(parameter)
+        if written is None:
+            break
+    code = {cell for operation in operations.values() for cell in operation.cells}
+    # a value that is not an instruction yet may become one when written
+    code.update(
+        address for operation in operations.values()
+        for address in successors(program, operation)[0] if address not in operations)
+    indirect = any(block.indirect for block in blocks.values())
+    if written is None or indirect or code & written:
+        return Analysis(operations, blocks, None if indirect or written is None else frozenset(written),
+                        None if read is None else frozenset(read), frozenset())
+    # Jump targets read from memory are only known if nothing writes there.
+    for operation in operations.values():
+        if operation.opcode in JUMPS and operation.modes[1] == Mode.POSITION and operation.parameters[1] in written:
+            return Analysis(operations, blocks, None, frozenset(read), frozenset())
+    return Analysis(operations, blocks, frozenset(written), frozenset(read), frozenset(code))
+
+def optimize(program: Sequence[int]) -> List[int]:
+    # Rewrites the frozen operations that nothing reads as data, without
+    # moving anything, so every address stays the same:
+    # - position parameters reading cells that are never written become
+    #   immediate,
+    # - arithmetic and comparisons on two immediates are folded into an
+    #   ADD of the result and 0,
+    # - jumps to an unconditional jump go to its target directly.
+    # The optimized program gives the same outputs when it is run as it is,
+    # a caller that patches it before running, like day 2, must not use it.
+    analysis = analyze(program)
+    optimized = list(program)
+    if analysis.read is None or not analysis.frozen:
+        return optimized
+    untouched = {
+        address: operation for address, operation in analysis.operations.items()
+        if not any(cell in analysis.read for cell in operation.cells)}
+
+    def constant(parameter: int, mode: Mode) -> Optional[int]:
+        if mode == Mode.IMMEDIATE:
+            return parameter
+        if 0 <= parameter < len(program) and parameter not in analysis.written:
+            return program[parameter]
+        return None
+
+    def destination(operation: Operation) -> Optional[int]:
+        # where an unconditional jump always goes
+        if operation.opcode not in JUMPS:
+            return None
+        condition = constant(operation.parameters[0], operation.modes[0])
+        if condition is None or bool(condition) != (operation.opcode == Opcode.JUMP_IF_TRUE):
+            return None
+        return constant(operation.parameters[1], operation.modes[1])
+
+    for address, operation in untouched.items():
+        modes = list(operation.modes)
+        parameters = list(operation.parameters)
+        written = WRITTEN.get(operation.opcode)
+        for index, (parameter, mode) in enumerate(zip(parameters, modes)):
+            value = constant(parameter, mode)
+            if index + 1 != written and value is not None:
+                modes[index], parameters[index] = Mode.IMMEDIATE, value
+        opcode = operation.opcode
+        if opcode in FOLDED and modes[0] == modes[1] == Mode.IMMEDIATE:
+            opcode = Opcode.ADD
+            parameters[:2] = FOLDED[operation.opcode](parameters[0], parameters[1]), 0
+        if opcode in JUMPS and modes[1] == Mode.IMMEDIATE:
+            seen = {address}
+            target = parameters[1]
+            while target in analysis.operations and target not in seen:
+                seen.add(target)
+                following = destination(analysis.operations[target])
+                if following is None:
+                    break
+                target = following
+            parameters[1] = target
+        rewritten = Operation(address, opcode, tuple(modes), tuple(parameters))
+        optimized[address:address + operation.size] = rewritten.encode()
+    return optimized
+
+# Counts cell 30 up to 5 and outputs it, the jump at 12 goes to the jump at
+# 19 that goes back to 4.
+LOOP = [
+    1101,0,0,30,
+    1,30,31,30,
+    7,30,32,33,
+    1005,33,19,
+    4,30,
+    99, 0,
+    1105,1,4,
+    0,0,0,0,0,0,0,0, 0, 1, 5, 0]
+
+def test_disassemble():
+    operations = disassemble(LOOP)
+    assert sorted(operations) == [0, 4, 8, 12, 15, 17, 19]
+    assert str(operations[4]) == '     4 ADD                  [30] [31] [30]'
+    assert operations[12].encode() == LOOP[12:15]
+    blocks = control_flow_graph(LOOP, operations)
+    assert sorted(blocks) == [0, 4, 15, 19]
+    assert blocks[4].successors == [15, 19] and blocks[19].successors == [4]
+    assert 'HALT' in listing(LOOP)
+
+def test_analyze():
+    analysis = analyze(LOOP)
+    assert analysis.written == {30, 33}
+    assert analysis.read == {30, 31, 32, 33}
+    assert 0 in analysis.frozen and 30 not in analysis.frozen
+    # day 5 patches one of its own instructions, day 7 jumps through a table
+    for name in ('d05input', 'd07input'):
+        assert not analyze(read_csv_input(name)[0]).frozen
+    assert analyze([109,1, 204,0, 99]).written is None
+
+def test_optimize():
+    optimized = optimize(LOOP)
+    assert optimized[4:8] == [1001,30,1,30]
+    assert optimized[8:12] == [1007,30,5,33]
+    assert optimized[12:15] == [1005,33,4]
+    assert IntComputer(program=optimized).run() == IntComputer(program=LOOP).run() == [5]
+    # folds arithmetic on two constants
+    program = [1,8,9,10, 4,10, 99, 0, 3,4, 0]
+    assert optimize(program)[:4] == [1101,7,0,10]
+    assert IntComputer(program=optimize(program)).run() == [7]
+    assert optimize([3,0,4,0,99]) == [3,0,4,0,99]
+
+@pytest.mark.parametrize('name', ['d02input', 'd05input', 'd07input'])
+def test_optimize_leaves_self_modifying_programs(name):
+    program = read_csv_input(name)[0]
+    assert optimize(program) == program
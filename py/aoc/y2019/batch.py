@@ -0,0 +1,259 @@
+from collections import defaultdict, deque
+from typing import DefaultDict, Deque, Iterable, List, Sequence
+
+import pytest
+
+from .computer import Instruction, Opcode, Mode, Status, GROWTH_FACTOR, PARAMETERS, RUNNING, BLOCKED, HALTED
+from .memory import PAGE_SIZE
+from .utils import read_csv_input
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+INT64_LIMIT = 2 ** 63
+ADDRESS_LIMIT = 2 ** 61
+
+class BatchComputer:
+    # Runs one Intcode program in many lanes at once, each lane being an
+    # independent machine with its own row of memory. Every step executes one
+    # instruction for all running lanes at the lowest pc that have the same
+    # instruction value, so lanes that went down different branches catch up
+    # and step together again. Memory is int64 until a result does not fit,
+    # then the whole batch continues on Python ints. Memory is widened for
+    # all lanes when an address past the end is used, as far as IntComputer
+    # grows a list before it switches to paged memory. Unlike IntComputer, a
+    # lane that uses an address beyond that, reads or jumps below 0 or hits
+    # an invalid instruction is marked as faulted and halted, the other
+    # lanes carry on. Needs numpy.
+    def __init__(self, program: Sequence[int], lanes: int):
+        if numpy is None:
+            raise RuntimeError('BatchComputer requires numpy')
+        self.memory = numpy.tile(numpy.array(program, dtype=numpy.int64), (lanes, 1))
+        self.pc = numpy.zeros(lanes, dtype=numpy.int64)
+        self.relative_base = numpy.zeros(lanes, dtype=numpy.int64)
+        self.status = numpy.full(lanes, RUNNING, dtype=numpy.int8)
+        self.faulted = numpy.zeros(lanes, dtype=bool)
+        # Most sweeps do little I/O, so lanes only get queues once used.
+        self.inbox: DefaultDict[int, Deque[int]] = defaultdict(deque)
+        self.outbox: DefaultDict[int, List[int]] = defaultdict(list)
+
+    def write(self, address: int, values) -> None:
+        values = numpy.asarray(values)
+        if self.memory.dtype != object and values.dtype == object:
+            self.promote()
+        if address >= self.memory.shape[1]:
+            self.widen(address + 1)
+        self.memory[:, address] = values
+
+    def promote(self) -> None:
+        self.memory = self.memory.astype(object)
+
+    def widen(self, cells: int) -> None:
+        # At least doubles, so that a growing stack is not copied every push.
+        lanes, width = self.memory.shape
+        padding = numpy.zeros((lanes, max(cells, 2 * width) - width), dtype=self.memory.dtype)
+        self.memory = numpy.concatenate((self.memory, padding), axis=1)
+
+    def fault(self, lanes) -> None:
+        self.faulted[lanes] = True
+        self.status[lanes] = HALTED
+
+    def run(self, inputs: Iterable[Iterable[int]] = ()) -> 'BatchComputer':
+        for lane, values in enumerate(inputs):
+            self.inbox[lane].extend(values)
+        self.status[self.status == BLOCKED] = RUNNING
+        while True:
+            running = numpy.flatnonzero(self.status == RUNNING)
+            if not running.size:
+                return self
+            pcs = self.pc[running]
+            pc = int(pcs.min())
+            lanes = running[pcs == pc]
+            values = self.memory[lanes, pc]
+            if (values == values[0]).all():
+                self.execute(int(values[0]), pc, lanes)
+                continue
+            for value in numpy.unique(values):
+                self.execute(int(value), pc, lanes[values == value])
+
+    def execute(self, value: int, pc: int, lanes) -> None:
+        try:
+            opcode, modes = Instruction.decode(value)
+        except ValueError:
+            self.fault(lanes)
+            return
+        count = PARAMETERS[opcode]
+        if pc + count >= self.memory.shape[1]:
+            self.widen(pc + count + 1)
+        memory = self.memory
+        cells = memory.shape[1]
+        # Gathers go through the flattened memory, which numpy does a lot
+        # faster than two dimensional fancy indexing.
+        flat = memory.reshape(-1)
+        rows = lanes * cells
+        parameters = [flat[rows + (pc + offset)] for offset in range(1, count + 1)]
+        # Position and relative parameters are turned into int64 addresses,
+        # immediate ones stay as they are. Python ints too large for an
+        # address are clipped to a value that is out of range as well, the
+        # sum with a clipped relative base still fits.
+        addresses = []
+        for parameter, mode in zip(parameters, modes):
+            if mode == Mode.IMMEDIATE:
+                addresses.append(None)
+                continue
+            if memory.dtype == object:
+                parameter = numpy.clip(parameter, -ADDRESS_LIMIT, ADDRESS_LIMIT).astype(numpy.int64)
+            addresses.append(parameter + self.relative_base[lanes] if mode == Mode.RELATIVE else parameter)
+        limit = GROWTH_FACTOR * cells + PAGE_SIZE
+        end = max((int(address[address < limit].max(initial=-1)) + 1 for address in addresses
+                   if address is not None), default=0)
+        if end > cells:
+            self.widen(end)
+            cells = self.memory.shape[1]
+            rows = lanes * cells
+        valid = numpy.ones(len(lanes), dtype=bool)
+        for address in addresses:
+            if address is not None:
+                valid &= (address >= 0) & (address < cells)
+        if not valid.all():
+            self.fault(lanes[~valid])
+            lanes, rows = lanes[valid], rows[valid]
+            parameters = [parameter[valid] for parameter in parameters]
+            addresses = [address if address is None else address[valid] for address in addresses]
+
+        def load(offset):
+            if addresses[offset] is None:
+                return parameters[offset]
+            return self.memory.reshape(-1)[rows + addresses[offset]]
+
+        def target(offset):
+            if addresses[offset] is None:
+                return rows + (pc + 1 + offset)
+            return rows + addresses[offset]
+
+        if opcode in (Opcode.ADD, Opcode.MULTIPLY):
+            x, y = load(0), load(1)
+            if self.memory.dtype != object and self.overflows(opcode, x, y):
+                self.promote()
+                x, y = x.astype(object), y.astype(object)
+            result = x + y if opcode == Opcode.ADD else x * y
+            self.memory.reshape(-1)[target(2)] = result
+            self.pc[lanes] = pc + 4
+        elif opcode in (Opcode.LESS_THAN, Opcode.EQUALS):
+            x, y = load(0), load(1)
+            result = (x < y) if opcode == Opcode.LESS_THAN else (x == y)
+            self.memory.reshape(-1)[target(2)] = result.astype(numpy.int64).astype(self.memory.dtype)
+            self.pc[lanes] = pc + 4
+        elif opcode in (Opcode.JUMP_IF_TRUE, Opcode.JUMP_IF_FALSE):
+            condition, destination = load(0), load(1)
+            taken = (condition != 0) if opcode == Opcode.JUMP_IF_TRUE else (condition == 0)
+            escaped = taken & ((destination < 0) | (destination >= cells))
+            if escaped.any():
+                self.fault(lanes[escaped])
+            taken &= ~escaped
+            self.pc[lanes] = numpy.where(taken, destination, pc + 3).astype(numpy.int64)
+        elif opcode == Opcode.READ_INPUT:
+            pointers = target(0)
+            for index, lane in enumerate(lanes.tolist()):
+                if not self.inbox.get(lane):
+                    self.status[lane] = BLOCKED
+                    continue
+                value = self.inbox[lane].popleft()
+                if self.memory.dtype != object and not -INT64_LIMIT <= value < INT64_LIMIT:
+                    self.promote()
+                self.memory.reshape(-1)[pointers[index]] = value
+                self.pc[lane] = pc + 2
+        elif opcode == Opcode.ADJUST_RELATIVE_BASE:
+            # Clipped like addresses, a base that far away makes every
+            # relative address fault while the lane goes on otherwise.
+            offsets = numpy.clip(load(0), -ADDRESS_LIMIT, ADDRESS_LIMIT).astype(numpy.int64)
+            self.relative_base[lanes] = numpy.clip(self.relative_base[lanes] + offsets, -ADDRESS_LIMIT, ADDRESS_LIMIT)
+            self.pc[lanes] = pc + 2
+        elif opcode == Opcode.WRITE_OUTPUT:
+            for lane, value in zip(lanes, load(0)):
+                self.outbox[int(lane)].append(int(value))
+            self.pc[lanes] = pc + 2
+        else:
+            self.status[lanes] = HALTED
+
+    @staticmethod
+    def overflows(opcode, x, y) -> bool:
+        # Magnitudes in floating point are approximate, near the limit this
+        # may promote a batch that would still have fit, the margin of the
+        # halved limit keeps rounding from missing a real overflow.
+        magnitude_x = numpy.abs(x.astype(numpy.float64))
+        magnitude_y = numpy.abs(y.astype(numpy.float64))
+        if opcode == Opcode.ADD:
+            return bool(((magnitude_x + magnitude_y) >= INT64_LIMIT / 2).any())
+        return bool((magnitude_x * magnitude_y >= INT64_LIMIT / 2).any())
+
+def test_batch_matches_single_machine():
+    numpy = pytest.importorskip('numpy')
+    from .d02 import load_program
+    program = read_csv_input('d02input')[0]
+    batch = BatchComputer(program, 100)
+    batch.write(1, numpy.arange(100))
+    batch.write(2, numpy.arange(100)[::-1])
+    batch.run()
+    trial = load_program()
+    assert all(batch.status == Status.HALTED)
+    assert list(batch.memory[:, 0]) == [trial(noun, 99 - noun) for noun in range(100)]
+
+def test_batch_diverging_lanes_and_io():
+    pytest.importorskip('numpy')
+    from .computer import IntComputer
+    program = read_csv_input('d05input')[0]
+    batch = BatchComputer(program, 3)
+    batch.run([[1], [5]])
+    assert batch.outbox[0] == IntComputer(program=program).run([1])
+    assert batch.outbox[1] == IntComputer(program=program).run([5])
+    assert batch.status[2] == Status.BLOCKED and batch.outbox[2] == []
+    batch.run([[], [], [8]])
+    assert batch.outbox[2] == IntComputer(program=program).run([8])
+
+def test_batch_relative_base():
+    pytest.importorskip('numpy')
+    from .computer import IntComputer
+    from .computer_tests import QUINE
+    batch = BatchComputer(QUINE, 2)
+    batch.write(1, [1, 2])
+    batch.run()
+    assert batch.outbox[0] == QUINE
+    assert batch.outbox[1] == IntComputer(program=[109,2] + QUINE[2:]).run()
+
+def test_batch_widens_memory():
+    pytest.importorskip('numpy')
+    from .computer import IntComputer
+    program = [1101,1,1,100, 4,100, 99]
+    batch = BatchComputer(program, 2).run()
+    assert batch.outbox == {0: [2], 1: [2]} and not any(batch.faulted)
+    assert batch.outbox[0] == IntComputer(program=program).run()
+    # the operands of the last instruction run past the end and read as 0
+    program = [1101,0,99,8, 1001,100]
+    batch = BatchComputer(program, 1).run()
+    single = IntComputer(program=program)
+    single.run()
+    assert list(batch.memory[0, :9]) == list(single.memory[:9]) and not batch.faulted[0]
+    # addresses that IntComputer keeps in paged memory fault the lane
+    batch = BatchComputer([1101,1,1,10**6, 99], 1).run()
+    assert batch.faulted[0]
+
+def test_batch_faults_and_overflow():
+    pytest.importorskip('numpy')
+    # Squares the input, 2 ** 40 squared no longer fits in int64.
+    program = [3,13, 1002,13,1,14, 2,13,14,13, 4,13, 99, 0, 0]
+    batch = BatchComputer(program, 2)
+    batch.run([[3], [2 ** 40]])
+    assert batch.outbox == {0: [9], 1: [2 ** 80]}
+    batch = BatchComputer([1105,1,7, 99], 1)
+    batch.run()
+    assert batch.faulted[0] and batch.status[0] == Status.HALTED
+    # patches a parameter of the next instruction with 2 ** 63
+    program = [1101,2**62,2**62,6, 1101,1,0,11, 4,11, 99, 0]
+    batch = BatchComputer(program, 1).run()
+    assert batch.outbox == {0: [2 ** 63 + 1]} and type(next(iter(batch.outbox))) is int
+    # 2 ** 63 used as an address faults the lane instead of the batch
+    batch = BatchComputer([1101,2**62,2**62,5, 4,0, 99], 2).run()
+    assert all(batch.faulted)
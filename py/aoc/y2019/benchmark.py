@@ -0,0 +1,486 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Union
+
+import pytest
+
+from .computer import IntComputer, Mode, Opcode
+from .network import Network
+from .utils import read_csv_input
+
+# Wall time and throughput of the Intcode engine on generated programs and
+# the puzzle workloads, one row per workload and engine variant. Run with
+# `python -m aoc.y2019.benchmark`, add --json for machine readable output.
+
+VARIANTS = {
+    'interpreter': {},
+    'jit': {'jit': True},
+    'overlay': {'overlay': True},
+    'int64': {'int64': True},
+}
+
+class Engine:
+    # Builds the computers of one workload run with the options of a
+    # variant, and counts the instructions they retire.
+    def __init__(self, options):
+        self.options = options
+        self.computers: List[IntComputer] = []
+
+    def __call__(self, program: Sequence[int]) -> IntComputer:
+        computer = IntComputer(program=program, **self.options)
+        self.computers.append(computer)
+        return computer
+
+    @property
+    def instructions(self) -> int:
+        return sum(computer.retired for computer in self.computers)
+
+def assemble(*parts: Union[str, Sequence[Union[int, str]]]) -> List[int]:
+    # Lays out lists of values one after the other. A name on its own marks
+    # the address of what follows, also in the middle of an instruction,
+    # and a name inside a list is replaced by that address.
+    labels: Dict[str, int] = {}
+    address = 0
+    for part in parts:
+        if isinstance(part, str):
+            labels[part] = address
+        else:
+            address += len(part)
+    return [
+        labels[value] if isinstance(value, str) else value
+        for part in parts if not isinstance(part, str) for value in part]
+
+def counting_loop(count: int) -> List[int]:
+    # Outputs count after counting up to it.
+    return assemble(
+        'loop',
+        [1001,'i',1,'i'],
+        [1007,'i',count,'flag'],
+        [1005,'flag','loop'],
+        [4,'i'],
+        [99],
+        'i', [0], 'flag', [0])
+
+def sieve(limit: int) -> List[int]:
+    # Outputs the number of primes below limit. The flags are addressed by
+    # patching the parameters of the instructions that use them.
+    return assemble(
+        'outer',
+        [1007,'p',limit,'flag'],
+        [1006,'flag','done'],
+        [1001,'p','sieve','probe'],
+        [1005], 'probe', [0,'next'],
+        [1001,'count',1,'count'],
+        [1,'p','p','m'],
+        'inner',
+        [1007,'m',limit,'flag'],
+        [1006,'flag','next'],
+        [1001,'m','sieve','mark'],
+        [1101,1,0], 'mark', [0],
+        [1,'m','p','m'],
+        [1105,1,'inner'],
+        'next',
+        [1001,'p',1,'p'],
+        [1105,1,'outer'],
+        'done',
+        [4,'count'],
+        [99],
+        'p', [2], 'm', [0], 'count', [0], 'flag', [0],
+        'sieve', [0] * limit)
+
+def copy_loop(size: int) -> List[int]:
+    # Copies size values with the relative base walking over them, and
+    # outputs the last value copied.
+    return assemble(
+        [109,'source'],
+        'loop',
+        [21201,0,0,size],
+        [109,1],
+        [1001,'i',1,'i'],
+        [1007,'i',size,'flag'],
+        [1005,'flag','loop'],
+        [204,size - 1],
+        [99],
+        'i', [0], 'flag', [0],
+        'source', list(range(1, size + 1)), [0] * size)
+
+# Outputs every input until it reads 0.
+ECHO_LOOP = assemble(
+    'loop',
+    [3,'value'],
+    [4,'value'],
+    [1005,'value','loop'],
+    [99],
+    'value', [0])
+
+COUNT = 100_000
+PRIMES_BELOW = 20_000
+COPIED = 30_000
+ECHOED = 30_000
+
+def counting(engine):
+    return engine(counting_loop(COUNT)).run()[0]
+
+def primes(engine):
+    return engine(sieve(PRIMES_BELOW)).run()[0]
+
+def copying(engine):
+    return engine(copy_loop(COPIED)).run()[0]
+
+def echoing(engine):
+    return len(engine(ECHO_LOOP).run([1] * ECHOED + [0]))
+
+def d02_search(engine):
+    program = read_csv_input('d02input')[0]
+    computer = engine(program)
+    for noun, verb in itertools.product(range(100), range(100)):
+        computer.reset()
+        computer.write(1, noun)
+        computer.write(2, verb)
+        computer.run()
+        if computer.memory[0] == 19690720:
+            return 100 * noun + verb
+
+def d05_diagnostics(engine):
+    program = read_csv_input('d05input')[0]
+    return [engine(program).run([system_id])[-1] for system_id in (1, 5)]
+
+def d07_amplifiers(engine):
+    program = read_csv_input('d07input')[0]
+    maximum = 0
+    for phase_settings in itertools.permutations(range(5)):
+        signal = 0
+        for phase_setting in phase_settings:
+            signal = engine(program).run([phase_setting, signal])[0]
+        maximum = max(maximum, signal)
+    return maximum
+
+def d07_feedback(engine):
+    program = read_csv_input('d07input')[0]
+    maximum = 0
+    for phase_settings in itertools.permutations(range(5, 10)):
+        network = Network()
+        for index, phase_setting in enumerate(phase_settings):
+            network.add(str(index), engine(program), [phase_setting])
+        for index in range(len(phase_settings)):
+            network.connect(str(index), str((index + 1) % len(phase_settings)))
+        network.send('0', 0)
+        network.run()
+        maximum = max(maximum, network.machines['0'].computer.inbox[-1])
+    return maximum
+
+# The day 2, day 5 and asynchronous day 7 engines as they were before every
+# puzzle ran on IntComputer, the baseline the variants are compared with.
+
+def baseline_evaluate(program):
+    state = list(program)
+    pc = 0 # the program counter
+    while True:
+        opcode = state[pc]
+        if opcode == 99:
+            return state
+        # dereference arguments
+        a_ref = state[pc+1]
+        b_ref = state[pc+2]
+        r_ref = state[pc+3]
+        a = state[a_ref]
+        b = state[b_ref]
+        if opcode == 1:   # addition
+            r = a + b
+        elif opcode == 2: # multiplication
+            r = a * b
+        else:
+            raise ValueError(f'invalid opcode: {opcode}')
+        state[r_ref] = r
+        pc += 4
+
+class BaselineComputer:
+    def __init__(self, program):
+        self.memory = list(program)
+        self.pc = 0
+        self.opcode = Opcode.HALT
+        self.modes = (Mode.IMMEDIATE, Mode.IMMEDIATE, Mode.IMMEDIATE)
+
+    def decode(self):
+        instruction = self.memory[self.pc]
+        c = instruction // 10_000
+        rest = instruction % 10_000
+        b = rest // 1_000
+        rest = rest % 1_000
+        a = rest // 100
+        self.opcode = Opcode(rest % 100)
+        self.modes = (Mode(a), Mode(b), Mode(c))
+
+    def load(self, offset):
+        address = self.pc + offset
+        value = self.memory[address]
+        mode = self.modes[offset-1]
+        if (mode == Mode.IMMEDIATE):
+            return value
+        elif (mode == Mode.POSITION):
+            return self.memory[value]
+        else:
+            raise ValueError('Invalid mode', mode)
+
+    def store(self, offset, value):
+        address = self.pc + offset
+        mode = self.modes[offset-1]
+        if (mode == Mode.IMMEDIATE):
+            self.memory[address] = value
+        elif (mode == Mode.POSITION):
+            pointer = self.memory[address]
+            self.memory[pointer] = value
+
+    def evaluate(self, input=None):
+        self.pc = 0
+        output = []
+        halt = False
+        input = deque(input) if input else deque()
+        while not halt:
+            self.decode()
+            if self.opcode == Opcode.ADD:
+                a = self.load(1)
+                b = self.load(2)
+                c = a + b
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.MULTIPLY:
+                a = self.load(1)
+                b = self.load(2)
+                c = a * b
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.READ_INPUT:
+                c = input.popleft()
+                self.store(1, c)
+                self.pc += 2
+            elif self.opcode == Opcode.WRITE_OUTPUT:
+                a = self.load(1)
+                output.append(a)
+                self.pc += 2
+            elif self.opcode == Opcode.JUMP_IF_TRUE:
+                a = self.load(1)
+                if a:
+                    b = self.load(2)
+                    self.pc = b
+                else:
+                    self.pc += 3
+            elif self.opcode == Opcode.JUMP_IF_FALSE:
+                a = self.load(1)
+                if not a:
+                    b = self.load(2)
+                    self.pc = b
+                else:
+                    self.pc += 3
+            elif self.opcode == Opcode.LESS_THAN:
+                a = self.load(1)
+                b = self.load(2)
+                c = int(a < b)
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.EQUALS:
+                a = self.load(1)
+                b = self.load(2)
+                c = int(a == b)
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.HALT:
+                halt = True
+            else:
+                raise ValueError('Unknown opcode', self.opcode)
+        return output
+
+class AsyncBaselineComputer(BaselineComputer):
+    def __init__(self, program, input=None, output=None):
+        super().__init__(program)
+        self.input = input if input else asyncio.Queue()
+        self.output = output if output else asyncio.Queue()
+
+    async def evaluate(self, input=None):
+        self.pc = 0
+        halt = False
+        if input:
+            for item in input:
+                await self.input.put(item)
+        while not halt:
+            self.decode()
+            if self.opcode == Opcode.ADD:
+                a = self.load(1)
+                b = self.load(2)
+                c = a + b
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.MULTIPLY:
+                a = self.load(1)
+                b = self.load(2)
+                c = a * b
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.READ_INPUT:
+                c = await self.input.get()
+                self.store(1, c)
+                self.pc += 2
+            elif self.opcode == Opcode.WRITE_OUTPUT:
+                a = self.load(1)
+                await self.output.put(a)
+                self.pc += 2
+            elif self.opcode == Opcode.JUMP_IF_TRUE:
+                a = self.load(1)
+                if a:
+                    b = self.load(2)
+                    self.pc = b
+                else:
+                    self.pc += 3
+            elif self.opcode == Opcode.JUMP_IF_FALSE:
+                a = self.load(1)
+                if not a:
+                    b = self.load(2)
+                    self.pc = b
+                else:
+                    self.pc += 3
+            elif self.opcode == Opcode.LESS_THAN:
+                a = self.load(1)
+                b = self.load(2)
+                c = int(a < b)
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.EQUALS:
+                a = self.load(1)
+                b = self.load(2)
+                c = int(a == b)
+                self.store(3, c)
+                self.pc += 4
+            elif self.opcode == Opcode.HALT:
+                halt = True
+            else:
+                raise ValueError('Unknown opcode', self.opcode)
+
+def d02_search_baseline():
+    program = read_csv_input('d02input')[0]
+    for noun, verb in itertools.product(range(100), range(100)):
+        program[1] = noun
+        program[2] = verb
+        if baseline_evaluate(program)[0] == 19690720:
+            return 100 * noun + verb
+
+def d05_diagnostics_baseline():
+    program = read_csv_input('d05input')[0]
+    return [BaselineComputer(program).evaluate([system_id])[-1] for system_id in (1, 5)]
+
+def d07_amplifiers_baseline():
+    program = read_csv_input('d07input')[0]
+    maximum = 0
+    for phase_settings in itertools.permutations(range(5)):
+        signal = 0
+        for phase_setting in phase_settings:
+            signal = BaselineComputer(program).evaluate([phase_setting, signal])[0]
+        maximum = max(maximum, signal)
+    return maximum
+
+async def feedback_baseline(program):
+    maximum = 0
+    for phase_settings in itertools.permutations(range(5, 10)):
+        amplifiers = [AsyncBaselineComputer(program) for _ in phase_settings]
+        for index, amplifier in enumerate(amplifiers):
+            amplifier.input = amplifiers[index - 1].output
+        for amplifier, phase_setting in zip(amplifiers, phase_settings):
+            await amplifier.input.put(phase_setting)
+        runs = [amplifier.evaluate() for amplifier in amplifiers]
+        await amplifiers[0].input.put(0)
+        await asyncio.gather(*runs)
+        maximum = max(maximum, amplifiers[-1].output.get_nowait())
+    return maximum
+
+def d07_feedback_baseline():
+    return asyncio.run(feedback_baseline(read_csv_input('d07input')[0]))
+
+BASELINES = {
+    'd02_search': d02_search_baseline,
+    'd05_diagnostics': d05_diagnostics_baseline,
+    'd07_amplifiers': d07_amplifiers_baseline,
+    'd07_feedback': d07_feedback_baseline,
+}
+
+WORKLOADS = {
+    'counting': counting,
+    'primes': primes,
+    'copying': copying,
+    'echoing': echoing,
+    'd02_search': d02_search,
+    'd05_diagnostics': d05_diagnostics,
+    'd07_amplifiers': d07_amplifiers,
+    'd07_feedback': d07_feedback,
+}
+
+def measure(workload, options: Optional[dict], repeat=5) -> Dict[str, Union[float, int, None]]:
+    # Best wall time of repeat runs, and the instructions one run retires.
+    # A workload without options is a baseline, which counts nothing.
+    best = float('inf')
+    instructions = None
+    for _ in range(repeat):
+        engine = None if options is None else Engine(options)
+        start = time.perf_counter()
+        workload() if engine is None else workload(engine)
+        best = min(best, time.perf_counter() - start)
+        if engine is not None:
+            instructions = engine.instructions
+    return {
+        'seconds': best,
+        'instructions': instructions,
+        'instructions_per_second': None if instructions is None else instructions / best,
+    }
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the Intcode engine variants.')
+    parser.add_argument('workloads', nargs='*', help=f'any of {", ".join(WORKLOADS)}, all of them by default')
+    parser.add_argument('--variant', action='append', choices=list(VARIANTS), help='all of them by default')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print one JSON object per row')
+    arguments = parser.parse_args(arguments)
+    for name in arguments.workloads:
+        if name not in WORKLOADS:
+            parser.error(f'unknown workload {name}')
+    for name in arguments.workloads or WORKLOADS:
+        rows = []
+        if name in BASELINES:
+            rows.append(('baseline', measure(BASELINES[name], None, arguments.repeat)))
+        for variant in arguments.variant or VARIANTS:
+            rows.append((variant, measure(WORKLOADS[name], VARIANTS[variant], arguments.repeat)))
+        for variant, row in rows:
+            if arguments.json:
+                print(json.dumps({'workload': name, 'variant': variant, **row}), flush=True)
+                continue
+            rate = row['instructions_per_second']
+            rate = '' if rate is None else f'{rate / 1e6:9.2f} M instructions/s'
+            print(f'{name:<16} {variant:<12} {row["seconds"] * 1000:9.2f} ms {rate}'.rstrip(), flush=True)
+
+def test_baselines_agree():
+    for name, baseline in BASELINES.items():
+        assert baseline() == WORKLOADS[name](Engine({}))
+
+def test_generated_programs():
+    engine = Engine({})
+    assert engine(counting_loop(10)).run() == [10]
+    assert engine(copy_loop(10)).run() == [10]
+    assert engine(ECHO_LOOP).run([3, 2, 1, 0]) == [3, 2, 1, 0]
+    assert engine.instructions == (3 * 10 + 2) + (1 + 5 * 10 + 2) + (3 * 4 + 1)
+    assert engine(sieve(100)).run() == [25]
+
+@pytest.mark.parametrize('variant', list(VARIANTS))
+def test_variants_agree(variant):
+    engine = Engine(VARIANTS[variant])
+    assert engine(counting_loop(10)).run() == [10]
+    assert engine(sieve(100)).run() == [25]
+    assert engine(copy_loop(10)).run() == [10]
+
+def test_json_output(capsys):
+    main(['counting', '--variant', 'interpreter', '--repeat', '1', '--json'])
+    row = json.loads(capsys.readouterr().out)
+    assert row['workload'] == 'counting' and row['instructions'] == 3 * COUNT + 2
+
+if __name__ == '__main__':
+    main()
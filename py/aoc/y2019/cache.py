@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pathlib
+import pickle
+import tempfile
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+import pytest
+
+class Result(NamedTuple):
+    outputs: List[int]
+    memory: List[int]
+    pc: int
+    relative_base: int
+    # how many of the inputs the run read
+    consumed: int
+
+class ResultCache:
+    # Results of IntComputer.run() stored on disk, one file per run, keyed
+    # by a hash of the memory the run started from and its inputs. Runs are
+    # deterministic, so a run with the same key ends the same way. When the
+    # files add up to more than max_bytes, the least recently used ones are
+    # removed. Only run() consults the cache, resume(), interact(),
+    # evaluate() and networks feed inputs that depend on the outputs and
+    # always execute.
+    def __init__(self, directory: Union[str, os.PathLike], max_bytes: int = 64 << 20):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(memory: Sequence[int], inputs: Sequence[int]) -> str:
+        digest = hashlib.sha256()
+        digest.update(','.join(map(str, memory)).encode())
+        digest.update(b';')
+        digest.update(','.join(map(str, inputs)).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.directory / f'{key}.result'
+
+    def get(self, key: str) -> Optional[Result]:
+        path = self.path(key)
+        try:
+            with path.open('rb') as file:
+                result = Result(*pickle.load(file))
+            # the modification time orders the entries for eviction
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result: Result) -> None:
+        # Written to a temporary file first, so a concurrent reader never
+        # sees half of an entry.
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            pickle.dump(tuple(result), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.directory.glob('*.result'):
+            try:
+                status = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime_ns, status.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.directory.glob('*.result'))
+
+def test_cached_runs(tmp_path):
+    from .computer import IntComputer
+    from .utils import read_csv_input
+    program = read_csv_input('d05input')[0]
+    cache = ResultCache(tmp_path)
+    first = IntComputer(program=program, cache=cache)
+    assert first.run([5]) == [9386583]
+    assert (cache.hits, cache.misses) == (0, 1)
+    second = IntComputer(program=program, cache=cache)
+    assert second.run([5]) == [9386583]
+    assert cache.hits == 1 and second.retired == 0
+    assert second.memory == first.memory and second.pc == first.pc
+    second.reset()
+    assert second.run([1])[-1] == 16489636
+    assert cache.hits == 1 and len(cache) == 2
+    second.reset()
+    retired = second.retired
+    assert second.run([1])[-1] == 16489636
+    assert cache.hits == 2 and second.retired == retired
+    # memory left by a run is part of the key of the next one
+    assert ResultCache.key(first.memory, [5]) != ResultCache.key(program, [5])
+
+def test_cache_bypassed_when_input_is_missing(tmp_path):
+    from .computer import IntComputer, InputRequired
+    cache = ResultCache(tmp_path)
+    computer = IntComputer(program=[3,0, 3,0, 4,0, 99], cache=cache)
+    with pytest.raises(InputRequired):
+        computer.run([1])
+    assert len(cache) == 0
+    computer.inbox.append(2)
+    computer.resume()
+    assert list(computer.outbox) == [2] and len(cache) == 0
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=400)
+    for index in range(6):
+        cache.put(str(index), Result([index], [0] * 40, 0, 0, 0))
+        os.utime(cache.path(str(index)), ns=(index, index))
+    assert cache.get('5') is not None
+    assert len(cache) < 6 and cache.get('0') is None
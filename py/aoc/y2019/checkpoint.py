@@ -0,0 +1,247 @@
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import pytest
+
+from .computer import IntComputer, Status
+from .memory import Overlay
+from .utils import read_csv_input
+
+# The state of an IntComputer in a versioned binary format, all little
+# endian:
+# - the header: magic, version, status, flags, pc, relative base,
+#   instructions retired and the length of memory,
+# - the inbox and the outbox as value sections,
+# - memory, either as one value section of every cell, or with DELTA as
+#   the digest of the program image followed by a section of addresses and
+#   a value section of what those addresses hold where it differs from the
+#   image.
+# A value section is a count and that many int64 values, then the values
+# that do not fit in an int64, which hold 0, as a count and for each the
+# index, the size and the signed bytes of the value. Every section is
+# padded to 8 bytes, so the int64 values can be used where they are.
+MAGIC = b'ICKP'
+VERSION = 1
+DELTA = 1
+
+HEADER = struct.Struct('<4sHBBqqqq')
+COUNT = struct.Struct('<q')
+ESCAPE = struct.Struct('<qq')
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+def digest(image: Sequence[int]) -> bytes:
+    # of the int64 values, or of the text of the values if they do not fit
+    try:
+        data = array('q', image).tobytes()
+    except OverflowError:
+        data = ','.join(map(str, image)).encode()
+    return hashlib.sha256(data).digest()
+
+def pad(out: bytearray) -> None:
+    out.extend(bytes(-len(out) % 8))
+
+def write_values(out: bytearray, values: Sequence[int]) -> None:
+    try:
+        cells = array('q', values)
+        escapes = []
+    except OverflowError:
+        cells = array('q')
+        escapes = []
+        for index, value in enumerate(values):
+            if -2**63 <= value < 2**63:
+                cells.append(value)
+            else:
+                cells.append(0)
+                escapes.append((index, value))
+    out.extend(COUNT.pack(len(cells)))
+    out.extend(cells.tobytes())
+    out.extend(COUNT.pack(len(escapes)))
+    for index, value in escapes:
+        size = (value.bit_length() + 8) // 8
+        out.extend(ESCAPE.pack(index, size))
+        out.extend(value.to_bytes(size, 'little', signed=True))
+        pad(out)
+
+def read_values(view: memoryview, offset: int) -> Tuple[memoryview, Dict[int, int], int]:
+    # The int64 values as a view of the buffer, the values that did not fit
+    # by index, and where the section ends.
+    count, = COUNT.unpack_from(view, offset)
+    offset += COUNT.size
+    cells = view[offset:offset + 8 * count].cast('q')
+    offset += 8 * count
+    escapes = {}
+    total, = COUNT.unpack_from(view, offset)
+    offset += COUNT.size
+    for _ in range(total):
+        index, size = ESCAPE.unpack_from(view, offset)
+        offset += ESCAPE.size
+        escapes[index] = int.from_bytes(view[offset:offset + size], 'little', signed=True)
+        offset += size + -size % 8
+    return cells, escapes, offset
+
+def values(cells: memoryview, escapes: Dict[int, int]) -> Union[memoryview, List[int]]:
+    if not escapes:
+        return cells
+    values = cells.tolist()
+    for index, value in escapes.items():
+        values[index] = value
+    return values
+
+def dumps(computer: IntComputer, delta: bool = False) -> bytes:
+    # With delta only the cells that differ from the program image are
+    # stored, and the image is needed to load the checkpoint.
+    memory = computer.memory
+    if isinstance(memory, Overlay):
+        # iterating an overlay stops at the end of the image
+        memory = [memory[address] for address in range(max(len(memory), max(memory.writes, default=-1) + 1))]
+    else:
+        memory = list(memory)
+    out = bytearray(HEADER.pack(
+        MAGIC, VERSION, computer.status, DELTA if delta else 0,
+        computer.pc, computer.relative_base, computer.retired, len(memory)))
+    write_values(out, list(computer.inbox))
+    write_values(out, list(computer.outbox))
+    if delta:
+        image = computer.image
+        out.extend(digest(image))
+        changed = [address for address, (value, original) in enumerate(zip(memory, image)) if value != original]
+        changed.extend(range(len(image), len(memory)))
+        out.extend(COUNT.pack(len(changed)))
+        out.extend(array('q', changed).tobytes())
+        write_values(out, [memory[address] for address in changed])
+    else:
+        write_values(out, memory)
+    return bytes(out)
+
+def loads(buffer: Buffer, program: Optional[Sequence[int]] = None, **options) -> IntComputer:
+    # Builds a machine in the checkpointed state, with the options of
+    # IntComputer. A checkpoint is applied to program, which reset() goes
+    # back to, and which for a delta checkpoint has to be the image it was
+    # made from. Without a program, a full checkpoint becomes the program
+    # image of the machine, its memory is then read from the buffer where
+    # it is, without a copy with overlay memory.
+    view = memoryview(buffer)
+    magic, version, status, flags, pc, relative_base, retired, length = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError('Not an Intcode checkpoint')
+    if version > VERSION:
+        raise ValueError('Unsupported checkpoint version', version)
+    offset = HEADER.size
+    inbox, escapes, offset = read_values(view, offset)
+    inbox = values(inbox, escapes)
+    outbox, escapes, offset = read_values(view, offset)
+    outbox = values(outbox, escapes)
+    if flags & DELTA:
+        if program is None:
+            raise ValueError('A delta checkpoint needs the program image it was made from')
+        if bytes(view[offset:offset + 32]) != digest(program):
+            raise ValueError('The checkpoint was made from another program image')
+        offset += 32
+        count, = COUNT.unpack_from(view, offset)
+        offset += COUNT.size
+        addresses = view[offset:offset + 8 * count].cast('q')
+        offset += 8 * count
+        cells, escapes, offset = read_values(view, offset)
+        computer = IntComputer(program=program, **options)
+        grow(computer, length)
+        for index, (address, value) in enumerate(zip(addresses, cells)):
+            computer.write(address, escapes.get(index, value))
+    else:
+        cells, escapes, offset = read_values(view, offset)
+        memory = values(cells, escapes)
+        if program is None:
+            computer = IntComputer(program=memory, **options)
+        else:
+            if len(program) > length:
+                raise ValueError('The checkpoint was made from another program image')
+            computer = IntComputer(program=program, **options)
+            grow(computer, length)
+            for address, value in enumerate(memory):
+                if address >= len(program) or value != program[address]:
+                    computer.write(address, value)
+    computer.pc = pc
+    computer.relative_base = relative_base
+    computer.retired = retired
+    computer.status = Status(status)
+    computer.inbox.extend(inbox)
+    computer.outbox.extend(outbox)
+    return computer
+
+def grow(computer: IntComputer, length: int) -> None:
+    if isinstance(computer.memory, (list, array)) and length > len(computer.memory):
+        computer.memory.extend([0] * (length - len(computer.memory)))
+
+def save(computer: IntComputer, path: Union[str, os.PathLike], delta: bool = False) -> None:
+    with open(path, 'wb') as file:
+        file.write(dumps(computer, delta))
+
+def load(path: Union[str, os.PathLike], program: Optional[Sequence[int]] = None, **options) -> IntComputer:
+    # The file is mapped rather than read, memory views of it keep it
+    # mapped for as long as the machine uses them.
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads(mapped, program, **options)
+
+# Adds up its inputs until it reads 0, then outputs the sum.
+SUM = [3,13, 1,13,14,14, 1005,13,0, 4,14, 99, 0, 0, 0]
+
+@pytest.mark.parametrize('delta', [False, True])
+@pytest.mark.parametrize('options', [{}, {'overlay': True}, {'paged': True}, {'jit': True}, {'int64': True}])
+def test_round_trip(delta, options):
+    computer = IntComputer(program=SUM, **options)
+    computer.inbox.extend([2**70, 5])
+    assert computer.resume() == Status.BLOCKED
+    computer.outbox.extend([-2**80, 7])
+    # memory that grew past the program
+    if isinstance(computer.memory, (list, array)):
+        computer.memory.extend([0] * 6)
+    computer.write(20, -3)
+    data = dumps(computer, delta)
+    restored = loads(data, SUM, **options)
+    assert [restored.memory[address] for address in range(21)] == [computer.memory[address] for address in range(21)]
+    assert (restored.pc, restored.relative_base, restored.retired, restored.status) == (
+        computer.pc, computer.relative_base, computer.retired, computer.status)
+    assert list(restored.outbox) == [-2**80, 7]
+    restored.inbox.append(0)
+    assert restored.resume() == Status.HALTED
+    assert list(restored.outbox)[-1] == 2**70 + 5
+    restored.reset()
+    assert [restored.memory[address] for address in range(len(SUM))] == SUM
+
+def test_full_checkpoint_of_another_program():
+    with pytest.raises(ValueError):
+        loads(dumps(IntComputer(program=[99])), SUM)
+
+def test_delta_is_small_and_checks_the_image():
+    program = read_csv_input('d05input')[0]
+    computer = IntComputer(program=program)
+    computer.run([5])
+    full, delta = dumps(computer), dumps(computer, delta=True)
+    assert len(delta) < len(full) // 4
+    assert list(loads(delta, program).memory) == computer.memory
+    with pytest.raises(ValueError):
+        loads(delta)
+    with pytest.raises(ValueError):
+        loads(delta, SUM)
+    with pytest.raises(ValueError):
+        loads(b'XXXX' + full[4:])
+
+def test_save_and_load(tmp_path):
+    computer = IntComputer(program=SUM)
+    computer.inbox.extend([4, 5])
+    computer.resume()
+    path = tmp_path / 'sum.checkpoint'
+    save(computer, path)
+    restored = load(path, overlay=True)
+    assert isinstance(restored.image, memoryview)
+    restored.inbox.append(0)
+    restored.resume()
+    assert list(restored.outbox) == [9]
+    # the checkpointed memory is the image the machine resets to
+    restored.reset()
+    assert restored.memory[14] == 9 and restored.memory.writes == {}
@@ -1,16 +1,27 @@
 import asyncio
+import copy
+import functools
+import sys
+import time
+from array import array
 from collections import deque
-from dataclasses import dataclass
-from typing import List, Tuple, Callable, Mapping, Awaitable
+from typing import (
+    AsyncIterable, AsyncIterator, Deque, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Sequence,
+    Set, Tuple, Union, Callable, Mapping, Awaitable)
 from enum import IntEnum
 
 import pytest
 
+from .cache import Result, ResultCache
+from .memory import Overlay, PagedMemory, PAGE_SIZE, int64_cells
+from .profiler import Profile
+from .trace import Trace, TraceEntry
 from .utils import read_csv_input
 
 class Mode(IntEnum):
     POSITION = 0
     IMMEDIATE = 1
+    RELATIVE = 2
 
 class Opcode(IntEnum):
     ADD = 1
@@ -21,14 +32,57 @@ class Opcode(IntEnum):
     JUMP_IF_FALSE = 6
     LESS_THAN = 7
     EQUALS = 8
+    ADJUST_RELATIVE_BASE = 9
     HALT = 99
 
-@dataclass
-class Instruction:
+PARAMETERS = {
+    Opcode.ADD: 3,
+    Opcode.MULTIPLY: 3,
+    Opcode.READ_INPUT: 1,
+    Opcode.WRITE_OUTPUT: 1,
+    Opcode.JUMP_IF_TRUE: 2,
+    Opcode.JUMP_IF_FALSE: 2,
+    Opcode.LESS_THAN: 3,
+    Opcode.EQUALS: 3,
+    Opcode.ADJUST_RELATIVE_BASE: 1,
+    Opcode.HALT: 0,
+}
+
+# Which parameter an instruction writes its result to.
+WRITTEN = {
+    Opcode.ADD: 3,
+    Opcode.MULTIPLY: 3,
+    Opcode.READ_INPUT: 1,
+    Opcode.LESS_THAN: 3,
+    Opcode.EQUALS: 3,
+}
+
+# Cached instructions with a relative parameter have this added to their
+# opcode, which keeps them off the branches for the common modes.
+RELATIVE_RECORD = 10
+
+# A list memory that is addressed past its end grows in place up to this
+# many times its size, beyond that it is converted to paged memory.
+GROWTH_FACTOR = 4
+
+# Runs with a limit check it after about this many instructions, at the
+# next jump or block boundary.
+LIMIT_INTERVAL = 10_000
+
+# A start address that had to be compiled this many times keeps getting its
+# code patched, and is interpreted from then on. Patched parameters, like
+# the noun and verb of day 2, are read from memory by the next compilation,
+# which is not dropped when they are patched again.
+COMPILE_LIMIT = 3
+
+class Instruction(NamedTuple):
     opcode: Opcode
-    modes: Tuple[Mode]
+    modes: Tuple[Mode, Mode, Mode]
 
+    # Only the instruction value determines the decoding, so the records are
+    # shared between addresses and machines.
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def decode(instruction: int) -> 'Instruction':
         a = instruction // 10_000
         rest = instruction % 10_000
@@ -39,117 +93,1262 @@ class Instruction:
         modes = (Mode(c), Mode(b), Mode(a))
         return Instruction(opcode=opcode, modes=modes)
 
+
+# Opcodes that can be part of a compiled block, jumps end the block.
+BLOCK_OPERATORS = {
+    Opcode.ADD: '{} + {}',
+    Opcode.MULTIPLY: '{} * {}',
+    Opcode.LESS_THAN: '1 if {} < {} else 0',
+    Opcode.EQUALS: '1 if {} == {} else 0',
+}
+BLOCK_JUMPS = {
+    Opcode.JUMP_IF_TRUE: '{}',
+    Opcode.JUMP_IF_FALSE: 'not {}',
+}
+BLOCK_OPCODES = frozenset((*BLOCK_OPERATORS, *BLOCK_JUMPS))
+
+# Compiled blocks are shared by every machine that runs the same code, this
+# many of them are kept.
+BLOCK_CACHE_SIZE = 4096
+
+# The exit condition of a counting loop, as a comparison of the counter
+# that the loop goes on with.
+LOOP_CONDITIONS = {
+    # (jump, comparison, counter first)
+    (Opcode.JUMP_IF_TRUE, Opcode.LESS_THAN, True): 'lt',
+    (Opcode.JUMP_IF_TRUE, Opcode.LESS_THAN, False): 'gt',
+    (Opcode.JUMP_IF_FALSE, Opcode.LESS_THAN, True): 'ge',
+    (Opcode.JUMP_IF_FALSE, Opcode.LESS_THAN, False): 'le',
+    (Opcode.JUMP_IF_FALSE, Opcode.EQUALS, True): 'ne',
+    (Opcode.JUMP_IF_FALSE, Opcode.EQUALS, False): 'ne',
+}
+# Lines computing n, the iteration the loop exits after, from the value a
+# the condition sees before the first iteration, the step k and the bound
+# v. n stays None where the loop would never exit or the step goes the
+# wrong way, in which case the block runs once as usual.
+LOOP_ITERATIONS = {
+    'lt': ['if k > 0:', '    n = max(1, -((a - v) // k))'],
+    'le': ['if k > 0:', '    n = max(1, (v - a) // k + 1)'],
+    'gt': ['if k < 0:', '    n = max(1, -((v - a) // -k))'],
+    'ge': ['if k < 0:', '    n = max(1, (a - v) // -k + 1)'],
+    'ne': ['if k and (v - a) % k == 0 and (v - a) // k >= 1:', '    n = (v - a) // k'],
+}
+
+Operation = Tuple[Opcode, Tuple[Mode, ...], Tuple[int, ...]]
+
+# A compiled block takes (memory, code, invalidate) and returns the next pc
+# and the number of instructions it retired.
+Block = Callable[..., Tuple[int, int]]
+
+def counting_loop(address: int, operations: List[Operation], end: int) -> List[str]:
+    # Lines that take a block looping back to its own start straight to
+    # the state it exits in, or none when it is not a counting loop. Such a
+    # loop only adds steps that it does not change to its counters, and
+    # compares counters with values that it does not change, and the jump
+    # tests one of those comparisons, or a counter for not being 0. The
+    # value of a counter is then linear in the number of iterations.
+    *body, (jump, jump_modes, jump_parameters) = operations
+    if any(parameter is None for _, _, parameters in operations for parameter in parameters):
+        return []
+    if jump not in BLOCK_JUMPS or jump_modes[1] != Mode.IMMEDIATE or jump_parameters[1] != address or not body:
+        return []
+    written = {}
+    for position, (opcode, modes, parameters) in enumerate(body):
+        if modes[2] != Mode.POSITION or parameters[2] in written or address <= parameters[2] < end:
+            return []
+        written[parameters[2]] = position
+
+    def invariant(parameter: int, mode: Mode) -> Optional[str]:
+        if mode == Mode.IMMEDIATE:
+            return repr(parameter)
+        return None if parameter in written else f'memory[{parameter}]'
+
+    counters = {}
+    for position, (opcode, modes, parameters) in enumerate(body):
+        if opcode == Opcode.ADD:
+            target = parameters[2]
+            operands = list(zip(parameters[:2], modes[:2]))
+            for own, other in (operands, operands[::-1]):
+                if own == (target, Mode.POSITION) and invariant(*other) is not None:
+                    counters[target] = (invariant(*other), position)
+                    break
+            else:
+                return []
+
+    def value(counter: int, position: int, iteration: str) -> str:
+        # the counter as an instruction at position sees it
+        step, updated = counters[counter]
+        iteration = iteration if updated < position else f'({iteration} - 1)'
+        return f'c{counter} + {iteration} * k{counter}'
+
+    flags = {}
+    for position, (opcode, modes, parameters) in enumerate(body):
+        if opcode == Opcode.ADD:
+            continue
+        if opcode not in (Opcode.LESS_THAN, Opcode.EQUALS):
+            return []
+        (first, first_mode), (second, second_mode) = zip(parameters[:2], modes[:2])
+        if first_mode == Mode.POSITION and first in counters and invariant(second, second_mode) is not None:
+            flags[parameters[2]] = (opcode, first, invariant(second, second_mode), True, position)
+        elif second_mode == Mode.POSITION and second in counters and invariant(first, first_mode) is not None:
+            flags[parameters[2]] = (opcode, second, invariant(first, first_mode), False, position)
+        else:
+            return []
+    if jump_modes[0] != Mode.POSITION:
+        return []
+    tested = jump_parameters[0]
+    if tested in counters and jump == Opcode.JUMP_IF_TRUE:
+        condition, counter, bound, position = 'ne', tested, '0', len(body)
+    elif tested in flags:
+        opcode, counter, bound, counter_first, position = flags[tested]
+        condition = LOOP_CONDITIONS.get((jump, opcode, counter_first))
+        if condition is None:
+            return []
+    else:
+        return []
+    lines = [f'c{cell} = memory[{cell}]' for cell in counters]
+    lines += [f'k{cell} = {step}' for cell, (step, _) in counters.items()]
+    lines += [
+        'n = None',
+        f'k = k{counter}',
+        f'a = {value(counter, position, "0")}',
+        f'v = {bound}',
+        *LOOP_ITERATIONS[condition],
+        'if n is not None:']
+    for position, (opcode, modes, parameters) in enumerate(body):
+        target = parameters[2]
+        if target in counters:
+            lines.append(f'    memory[{target}] = c{target} + n * k{target}')
+        else:
+            opcode, counter, bound, counter_first, _ = flags[target]
+            operands = (value(counter, position, 'n'), bound)
+            expression = BLOCK_OPERATORS[opcode].format(*(operands if counter_first else operands[::-1]))
+            lines.append(f'    memory[{target}] = {expression}')
+        lines.append(f'    if {target} in code: invalidate({target})')
+    lines.append(f'    return {end}, n * {len(operations)}')
+    return lines
+
+@functools.lru_cache(maxsize=BLOCK_CACHE_SIZE)
+def build_block(address: int, cells: Tuple[Optional[int], ...], limit: int, checked: Tuple[int, ...]) -> Block:
+    # Translates the instructions in cells, which IntComputer.compile_block()
+    # found at address, into a Python function that executes them and
+    # returns the next pc and the number of instructions it retired. The
+    # code only depends on the address, the values of the cells and the
+    # size of the image, which are the cache key. A counting loop runs to
+    # its exit in one call.
+    # A parameter cell that is None is read when the block runs. Before an
+    # instruction with such an address outside of the image the block
+    # returns, for the interpreter to deal with it, and it returns after a
+    # write through one that lands on the code of the block. The block does
+    # not start unless the instructions in the checked cells are still the
+    # ones it was compiled from.
+    operations = []
+    offset = 0
+    while offset < len(cells):
+        opcode, modes = Instruction.decode(cells[offset])
+        length = 3 if opcode in BLOCK_JUMPS else 4
+        operations.append((opcode, modes, cells[offset + 1:offset + length]))
+        offset += length
+    end = address + len(cells)
+    lines = []
+    if checked:
+        checks = ' or '.join(f'memory[{cell}] != {cells[cell - address]}' for cell in checked)
+        lines.append(f'if {checks}: return {address}, 0')
+    lines += counting_loop(address, operations, end)
+    pc = address
+    for position, (opcode, modes, parameters) in enumerate(operations):
+        operands = []
+        addresses = []
+        for offset, (parameter, mode) in enumerate(zip(parameters, modes), 1):
+            if offset == 3 and mode == Mode.IMMEDIATE:
+                # the target is the parameter itself
+                break
+            if parameter is None:
+                parameter = f'p{offset}'
+                lines.append(f'{parameter} = memory[{pc + offset}]')
+                if mode == Mode.POSITION:
+                    addresses.append(parameter)
+            else:
+                parameter = repr(parameter)
+            operands.append(parameter if mode == Mode.IMMEDIATE else f'memory[{parameter}]')
+        if addresses:
+            checks = ' and '.join(f'0 <= {parameter} < {limit}' for parameter in addresses)
+            lines.append(f'if not ({checks}): return {pc}, {position}')
+        if opcode in BLOCK_JUMPS:
+            condition = BLOCK_JUMPS[opcode].format(operands[0])
+            # every instruction of a block runs, a taken jump is the last one
+            lines.append(f'if {condition}: return {operands[1]}, {len(operations)}')
+            pc += 3
+            continue
+        if modes[2] == Mode.IMMEDIATE:
+            target = pc + 3
+        else:
+            target = 'p3' if parameters[2] is None else parameters[2]
+        expression = BLOCK_OPERATORS[opcode].format(operands[0], operands[1])
+        lines.append(f'memory[{target}] = {expression}')
+        if target == 'p3':
+            lines += [
+                'if p3 in code:',
+                '    invalidate(p3)',
+                f'    if {address} <= p3 < {end}: return {pc + 4}, {position + 1}']
+        else:
+            lines.append(f'if {target} in code: invalidate({target})')
+        pc += 4
+    lines.append(f'return {end}, {len(operations)}')
+    source = 'def block(memory, code, invalidate):\n'
+    source += ''.join(f'    {line}\n' for line in lines)
+    namespace = {}
+    exec(compile(source, f'<intcode block {address}>', 'exec'), namespace)
+    return namespace['block']
+
+def unwatch(start: int, cells: Iterable[int], code: Dict[int, FrozenSet[int]]) -> None:
+    # Takes start off the cells in code, like IntComputer.watch() replacing
+    # the sets rather than changing them.
+    for cell in cells:
+        starts = code.get(cell, frozenset()) - {start}
+        if starts:
+            code[cell] = starts
+        else:
+            code.pop(cell, None)
+
+class ImageCode(NamedTuple):
+    # What machines decoded and compiled from an unmodified program image,
+    # with the cells each entry was built from, starts out every machine
+    # loaded with it. Interpreting machines only take the decoded records.
+    decoded: Dict[int, Tuple[int, int, int, int]]
+    blocks: Dict[int, Optional[Block]]
+    decoded_code: Dict[int, FrozenSet[int]]
+    code: Dict[int, FrozenSet[int]]
+
+@functools.lru_cache(maxsize=16)
+def image_code(image: Tuple[int, ...]) -> ImageCode:
+    return ImageCode({}, {}, {}, {})
+
+# The int64 cells of a program image, which int64 machines loaded with it
+# copy instead of converting the image again on every reset. Never
+# modified.
+image_cells = functools.lru_cache(maxsize=16)(int64_cells)
+
+def negative(address: int) -> int:
+    # The interpreter reads position parameters through this when they are
+    # negative.
+    raise IndexError('Negative address', address)
+
+class Status(IntEnum):
+    RUNNING = 0
+    BLOCKED = 1
+    HALTED = 2
+
+# Enum attribute lookups are slow on some Python versions, the per-run
+# bookkeeping uses these aliases instead.
+RUNNING, BLOCKED, HALTED = Status.RUNNING, Status.BLOCKED, Status.HALTED
+POSITION, IMMEDIATE, RELATIVE = Mode
+(ADD, MULTIPLY, READ_INPUT, WRITE_OUTPUT, JUMP_IF_TRUE, JUMP_IF_FALSE,
+ LESS_THAN, EQUALS, ADJUST_RELATIVE_BASE, HALT) = Opcode
+
+class Access(IntEnum):
+    READ = 0
+    WRITE = 1
+
+# Called before the instruction at a breakpoint runs, with the machine.
+Breakpoint = Callable[['IntComputer'], Optional[bool]]
+# Called before an instruction reads the watched address, or after it wrote
+# it, with the machine, the address and the access.
+Watchpoint = Callable[['IntComputer', int, Access], Optional[bool]]
+
 class HaltExecution(Exception):
     pass
 
+class InputRequired(Exception):
+    pass
+
+class Stopped(Exception):
+    # A breakpoint or watchpoint stopped the machine, which can be resumed.
+    pass
+
+class LimitExceeded(Exception):
+    pass
+
+class InstructionLimitExceeded(LimitExceeded):
+    pass
+
+class DeadlineExceeded(LimitExceeded):
+    pass
+
 class IntComputer:
-    memory: List[int]
+    image: Union[Tuple[int, ...], memoryview]
+    memory: Union[List[int], Overlay, PagedMemory]
+    decoded: Dict[int, Tuple[int, int, int, int]]
+    blocks: Dict[int, Optional[Block]]
+    code: Dict[int, FrozenSet[int]]
+    pristine: Dict[int, Tuple[int, int, int, int]]
+    pristine_blocks: Dict[int, Optional[Block]]
+    compilations: Dict[int, int]
+    stale: Set[int]
+    patched: Set[int]
+    shared: ImageCode
     pc: int
+    relative_base: int
+    retired: int
     opcode: Opcode
     modes: Tuple[Mode]
+    status: Status
+    profile: Optional[Profile]
+    trace: Optional[Trace]
+    cache: Optional[ResultCache]
+    breakpoints: Dict[int, Breakpoint]
+    watchpoints: Dict[int, Watchpoint]
+    stopped: Optional[int]
+    budget: Optional[int]
+    deadline: Optional[float]
+    inbox: Deque[int]
+    outbox: Deque[int]
     input: asyncio.Queue
     output: asyncio.Queue
 
-    def __init__(self, debug=False, input=None, output=None, program=None):
-        self.debug = bool(debug)
+    def __init__(
+            self, debug=False, input=None, output=None, program=None,
+            jit=False, overlay=False, paged=False, int64=False, profile=False, trace=None, cache=None):
+        # debug prints every instruction as it is retired
+        # int64 keeps memory in an int64 array instead of a list, which is
+        # turned into a list once a value does not fit. It cannot be combined
+        # with the jit, a block that overflowed half way through could not be
+        # run again.
+        if int64 and jit:
+            raise ValueError('int64 memory cannot be used with the jit')
+        if trace is None and debug:
+            trace = Trace(file=sys.stdout, live=True)
+        self.profile = Profile() if profile else None
+        self.trace = trace
+        self.cache = cache
+        self.breakpoints = {}
+        self.watchpoints = {}
+        self.stopped = None
+        self.budget = None
+        self.deadline = None
+        self.jit = bool(jit)
+        self.overlay = bool(overlay)
+        self.paged = bool(paged)
+        self.int64 = bool(int64)
         self.pc = 0
+        self.relative_base = 0
+        self.retired = 0
         self.opcode = Opcode.HALT
         self.modes = (Mode.IMMEDIATE, Mode.IMMEDIATE, Mode.IMMEDIATE)
+        self.status = Status.RUNNING
+        self.inbox = deque()
+        self.outbox = deque()
         self.input = input if input else asyncio.Queue()
         self.output = output if output else asyncio.Queue()
+        self.decoded = {}
+        self.blocks = {}
+        self.compilations = {}
+        self.code = {}
+        self.pristine = {}
+        self.pristine_blocks = {}
+        self.stale = set()
+        self.patched = set()
         if program:
             self.load_program(program)
 
     def decode(self):
-        instruction = self.memory[self.pc]
-        c = instruction // 10_000
-        rest = instruction % 10_000
-        b = rest // 1_000
-        rest = rest % 1_000
-        a = rest // 100
-        self.opcode = Opcode(rest % 100)
-        self.modes = (Mode(a), Mode(b), Mode(c))
-        if self.debug:
-            print(self.pc, self.opcode.name, *(m.name for m in self.modes))
+        if self.pc < 0:
+            raise IndexError('Negative address', self.pc)
+        self.opcode, self.modes = Instruction.decode(self.memory[self.pc])
 
     def load(self, offset: int) -> int:
+        mode = self.modes[offset-1]
+        if (mode == IMMEDIATE):
+            return self.memory[self.pc + offset]
+        return self.memory[self.pointer(offset)]
+
+    def pointer(self, offset: int) -> int:
+        # A negative address would index a list memory from its end.
         address = self.pc + offset
-        value = self.memory[address]
         mode = self.modes[offset-1]
-        if (mode == Mode.IMMEDIATE):
-            return value
-        elif (mode == Mode.POSITION):
-            return self.memory[value]
+        if (mode == IMMEDIATE):
+            return address
+        elif (mode == POSITION):
+            address = self.memory[address]
+        elif (mode == RELATIVE):
+            address = self.relative_base + self.memory[address]
         else:
             raise ValueError('Invalid mode', mode)
+        if address < 0:
+            raise IndexError('Negative address', address)
+        return address
 
     def store(self, offset: int, value: int) -> None:
-        address = self.pc + offset
-        mode = self.modes[offset-1]
-        if (mode == Mode.IMMEDIATE):
+        pointer = self.pointer(offset)
+        self.memory[pointer] = value
+        if pointer in self.code:
+            self.invalidate(pointer)
+
+    def write(self, address: int, value: int) -> None:
+        try:
             self.memory[address] = value
-        elif (mode == Mode.POSITION):
-            pointer = self.memory[address]
-            self.memory[pointer] = value
+        except OverflowError:
+            if not self.widen():
+                raise
+            self.memory[address] = value
+        if address in self.code:
+            self.invalidate(address)
+
+    def invalidate(self, address: int) -> None:
+        # Drops every cached instruction and compiled block that was built
+        # from the value at address, which counts as patched from then on.
+        self.patched.add(address)
+        for start in self.code.get(address, ()):
+            self.decoded.pop(start, None)
+            self.blocks.pop(start, None)
+            self.stale.add(start)
+
+    def watch(self, start: int, cells: Iterable[int]) -> bool:
+        # Registers the cells a cache entry at start was built from, and
+        # tells whether they still hold their values from the program image.
+        # Entries built from the image survive reset(), anything else is
+        # marked stale and dropped by it.
+        # The sets of starts may be shared with other machines and are
+        # replaced rather than changed.
+        code = self.code
+        pristine = True
+        for cell in cells:
+            starts = code.get(cell)
+            code[cell] = frozenset((start,)) if starts is None else starts | {start}
+            if cell >= len(self.image) or self.memory[cell] != self.image[cell]:
+                pristine = False
+        if not pristine:
+            self.stale.add(start)
+        return pristine
+
+    def compile_block(self, address: int) -> Optional[Block]:
+        # Finds the straight-line run of arithmetic and comparison
+        # instructions starting at address, up to and including the next
+        # jump, and gets it compiled by build_block(). Parameters are baked
+        # into the generated code, so the block registers every cell it was
+        # compiled from and gets dropped when one is written to. Parameters
+        # that the block writes to itself, or that were patched before, are
+        # read when the block runs instead, and instructions that it writes
+        # to itself are checked when it starts, like day 2 does with its
+        # results. Their cells are not registered. Blocks only address cells
+        # of the program image, which every machine loaded with it has, and
+        # may therefore be shared between machines.
+        memory = self.memory
+        limit = len(self.image)
+        if not 0 <= address < limit or memory[address] % 100 not in BLOCK_OPCODES:
+            # nothing to remember for an instruction that cannot start one
+            return None
+        targets = set()
+        instruction_cells = set()
+        parameter_cells = set()
+        pc = address
+        compilations = self.compilations[address] = self.compilations.get(address, 0) + 1
+        while 0 <= pc < limit and compilations <= COMPILE_LIMIT:
+            try:
+                instruction = Instruction.decode(memory[pc])
+            except ValueError:
+                break
+            opcode, modes = instruction.opcode, instruction.modes
+            if opcode in BLOCK_JUMPS:
+                length = 3
+            elif opcode in BLOCK_OPERATORS:
+                length = 4
+            else:
+                break
+            if pc + length > limit or Mode.RELATIVE in modes:
+                break
+            if any(pc <= target < pc + length for target in targets):
+                # an earlier instruction in the block rewrites this one
+                break
+            parameters = [memory[pc + offset] for offset in range(1, length)]
+            if any(mode == Mode.POSITION and not 0 <= parameter < limit and pc + offset not in self.patched
+                   for offset, (parameter, mode) in enumerate(zip(parameters, modes), 1)):
+                # leave addresses outside of the image for step() to deal with
+                break
+            instruction_cells.add(pc)
+            parameter_cells.update(range(pc + 1, pc + length))
+            pc += length
+            if opcode in BLOCK_JUMPS:
+                break
+            targets.add(pc - 1 if modes[2] == Mode.IMMEDIATE else parameters[2])
+        if pc == address:
+            block = None
+            read = set()
+            checked = ()
+            end = address + 1
+        else:
+            read = parameter_cells & (targets | self.patched)
+            checked = tuple(sorted(instruction_cells & targets))
+            cells = tuple(None if cell in read else memory[cell] for cell in range(address, pc))
+            block = build_block(address, cells, limit, checked)
+            end = pc
+        self.blocks[address] = block
+        # Not compiling is decided per machine, only blocks are published.
+        # Cells an earlier compilation was built from may not be registered
+        # now, except for the one at address while an instruction decoded
+        # there, which is registered with the same start, is kept.
+        unwatched = read.union(checked)
+        watched = [cell for cell in range(address, end) if cell not in unwatched]
+        decoded = address in self.decoded or address in self.pristine
+        unwatch(address, unwatched - {address} if decoded else unwatched, self.code)
+        pristine = self.watch(address, watched) and all(memory[cell] == self.image[cell] for cell in checked)
+        if pristine and block is not None:
+            self.pristine_blocks[address] = block
+            self.shared.blocks[address] = block
+            decoded = address in self.shared.decoded
+            unwatch(address, unwatched - {address} if decoded else unwatched, self.shared.code)
+            for cell in watched:
+                self.shared.code[cell] = self.shared.code.get(cell, frozenset()) | {address}
+        elif unwatched:
+            self.pristine_blocks.pop(address, None)
+        return block
+
+    def cache_instruction(self, address: int) -> Tuple[int, int, int, int]:
+        # Decoded instructions are cached by address as plain int
+        # (opcode, mode, mode, mode) records. They only depend on the cell
+        # holding the instruction, store() drops the entry when a program
+        # overwrites one of its own instructions.
+        opcode, modes = Instruction.decode(self.memory[address])
+        if Mode.RELATIVE in modes and opcode != Opcode.HALT:
+            opcode += RELATIVE_RECORD
+        instruction = self.decoded[address] = (int(opcode), *(int(mode) for mode in modes))
+        if self.watch(address, (address,)):
+            self.pristine[address] = instruction
+            shared = self.shared
+            shared.decoded[address] = instruction
+            shared.decoded_code[address] = shared.decoded_code.get(address, frozenset()) | {address}
+            shared.code[address] = shared.code.get(address, frozenset()) | {address}
+        return instruction
 
     def load_program(self, program):
-        self.memory = list(program) if program else []
+        # With overlay memory the machine only keeps its own writes on top of
+        # the program image, so machines loaded with the same tuple share it.
+        # A memoryview, like the values of a SharedImage, is kept as it is
+        # rather than copied into a tuple.
+        if isinstance(program, memoryview):
+            self.image = program
+        else:
+            self.image = tuple(program) if program else ()
+        if self.overlay:
+            self.memory = Overlay(self.image)
+        elif self.paged:
+            self.memory = PagedMemory(self.image)
+        elif self.int64:
+            self.memory = self.int64_memory()
+        else:
+            self.memory = list(self.image)
+        self.decoded = {}
+        self.blocks = {}
+        self.compilations = {}
+        self.code = {}
+        self.pristine = {}
+        self.pristine_blocks = {}
+        self.stale = set()
+        self.patched = set()
+        # Start out with what other machines built from the same image. A
+        # memoryview cannot be hashed, machines loaded with one build their
+        # own.
+        if isinstance(self.image, tuple):
+            shared = self.shared = image_code(self.image)
+        else:
+            shared = self.shared = ImageCode({}, {}, {}, {})
+        self.decoded.update(shared.decoded)
+        self.pristine.update(shared.decoded)
+        if self.jit:
+            self.blocks.update(shared.blocks)
+            self.pristine_blocks.update(shared.blocks)
+            self.code.update(shared.code)
+        else:
+            self.code.update(shared.decoded_code)
 
-    async def evaluate(self, input=None) -> List[int]:
+    def reset(self):
+        # Restores memory to the loaded program. Cache entries that were
+        # built from the program image are valid again afterwards, so only
+        # the ones touched since the last reset need to be put back.
+        # A list keeps the size it has grown to, compiled blocks may refer to
+        # the cells past the program. An int64 machine that had to switch to
+        # a list goes back to int64 cells.
+        memory = self.memory
+        if isinstance(memory, (list, array)):
+            grown = len(memory) - len(self.image)
+            if self.int64:
+                memory = self.memory = self.int64_memory()
+            else:
+                memory[:] = self.image
+            if grown:
+                memory.extend([0] * grown)
+        else:
+            memory.reset()
+        if self.stale:
+            for start in self.stale:
+                if start in self.pristine:
+                    self.decoded[start] = self.pristine[start]
+                else:
+                    self.decoded.pop(start, None)
+                if start in self.pristine_blocks:
+                    self.blocks[start] = self.pristine_blocks[start]
+                else:
+                    self.blocks.pop(start, None)
+            self.stale.clear()
         self.pc = 0
-        halt = False
-        if input:
-            for item in input:
-                await self.input.put(item)
-        while not halt:
-            self.decode()
-            if self.opcode == Opcode.ADD:
-                a = self.load(1)
+        self.relative_base = 0
+        self.stopped = None
+        self.status = RUNNING
+        self.inbox.clear()
+        self.outbox.clear()
+
+    def clone(self) -> 'IntComputer':
+        # A machine that continues independently from where this one is,
+        # with copies of its memory, queues, caches, breakpoints and
+        # watchpoints. A profile starts over, a trace and a result cache are
+        # shared.
+        clone = copy.copy(self)
+        clone.memory = self.memory[:] if isinstance(self.memory, (list, array)) else self.memory.copy()
+        clone.profile = None if self.profile is None else Profile()
+        clone.inbox = deque(self.inbox)
+        clone.outbox = deque(self.outbox)
+        clone.input = asyncio.Queue()
+        clone.output = asyncio.Queue()
+        clone.decoded = dict(self.decoded)
+        clone.blocks = dict(self.blocks)
+        clone.compilations = dict(self.compilations)
+        clone.code = dict(self.code)
+        clone.pristine = dict(self.pristine)
+        clone.pristine_blocks = dict(self.pristine_blocks)
+        clone.stale = set(self.stale)
+        clone.patched = set(self.patched)
+        clone.breakpoints = dict(self.breakpoints)
+        clone.watchpoints = dict(self.watchpoints)
+        return clone
+
+    def int64_memory(self) -> Union[array, List[int]]:
+        # A fresh int64 copy of the image, or a list if it does not fit.
+        if isinstance(self.image, tuple):
+            cells = image_cells(self.image)
+            return list(self.image) if cells is None else cells[:]
+        cells = int64_cells(self.image)
+        return list(self.image) if cells is None else cells
+
+    def widen(self) -> bool:
+        # Called when a value did not fit into int64 memory, which becomes a
+        # list of Python ints. Tells whether the memory was int64.
+        if not isinstance(self.memory, array):
+            return False
+        self.memory = self.memory.tolist()
+        return True
+
+    def grow(self) -> bool:
+        # Called when the instruction at pc ran into the end of a list
+        # memory. Makes room for every cell the instruction can touch, and
+        # tells whether anything was out of range to begin with.
+        memory = self.memory
+        if not isinstance(memory, (list, array)) or self.pc < 0:
+            return False
+        cells = [self.pc]
+        if self.pc < len(memory):
+            try:
+                opcode, modes = Instruction.decode(memory[self.pc])
+            except ValueError:
+                return False
+            for offset, mode in enumerate(modes[:PARAMETERS[opcode]], 1):
+                cell = self.pc + offset
+                cells.append(cell)
+                if mode != Mode.IMMEDIATE and cell < len(memory):
+                    cells.append(memory[cell] + (self.relative_base if mode == Mode.RELATIVE else 0))
+        end = max(cells) + 1
+        if end <= len(memory):
+            return False
+        if end <= GROWTH_FACTOR * len(memory) + PAGE_SIZE:
+            memory.extend([0] * (end - len(memory)))
+        else:
+            self.memory = PagedMemory(self.image, memory)
+        return True
+
+    def step(self) -> Status:
+        # Executes a single instruction through decode(), load() and store().
+        # Much slower than interpret(), but it is the path that profiling,
+        # tracing and anything else that needs to observe each instruction
+        # goes through.
+        self.decode()
+        opcode = self.opcode
+        if opcode == ADD:
+            a = self.load(1)
+            b = self.load(2)
+            c = a + b
+            self.store(3, c)
+            self.pc += 4
+        elif opcode == MULTIPLY:
+            a = self.load(1)
+            b = self.load(2)
+            c = a * b
+            self.store(3, c)
+            self.pc += 4
+        elif opcode == READ_INPUT:
+            if not self.inbox:
+                return BLOCKED
+            c = self.inbox[0]
+            self.store(1, c)
+            self.inbox.popleft()
+            self.pc += 2
+        elif opcode == WRITE_OUTPUT:
+            a = self.load(1)
+            self.outbox.append(a)
+            self.pc += 2
+        elif opcode == JUMP_IF_TRUE:
+            a = self.load(1)
+            if a:
                 b = self.load(2)
-                c = a + b
-                self.store(3, c)
-                self.pc += 4
-            elif self.opcode == Opcode.MULTIPLY:
-                a = self.load(1)
+                self.pc = b
+            else:
+                self.pc += 3
+        elif opcode == JUMP_IF_FALSE:
+            a = self.load(1)
+            if not a:
                 b = self.load(2)
-                c = a * b
-                self.store(3, c)
-                self.pc += 4
-            elif self.opcode == Opcode.READ_INPUT:
-                c = await self.input.get()
-                self.store(1, c)
-                self.pc += 2
-            elif self.opcode == Opcode.WRITE_OUTPUT:
-                a = self.load(1)
-                await self.output.put(a)
-                self.pc += 2
-            elif self.opcode == Opcode.JUMP_IF_TRUE:
-                a = self.load(1)
-                if a:
-                    b = self.load(2)
-                    self.pc = b
+                self.pc = b
+            else:
+                self.pc += 3
+        elif opcode == LESS_THAN:
+            a = self.load(1)
+            b = self.load(2)
+            c = int(a < b)
+            self.store(3, c)
+            self.pc += 4
+        elif opcode == EQUALS:
+            a = self.load(1)
+            b = self.load(2)
+            c = int(a == b)
+            self.store(3, c)
+            self.pc += 4
+        elif opcode == ADJUST_RELATIVE_BASE:
+            a = self.load(1)
+            self.relative_base += a
+            self.pc += 2
+        elif opcode == HALT:
+            self.retired += 1
+            return HALTED
+        else:
+            raise ValueError('Unknown opcode', self.opcode)
+        self.retired += 1
+        return RUNNING
+
+    def resume(self) -> Status:
+        # Runs from the current pc until the program halts or reaches an
+        # input instruction with nothing left in the inbox. A blocked machine
+        # leaves pc on the input instruction, so after more input has been
+        # added to the inbox it can simply be resumed. Instructions that run
+        # past the end of memory leave pc on themselves, and are retried once
+        # the memory has grown.
+        # With a trace, it is dumped when the program fails. A breakpoint or
+        # watchpoint that stops the machine leaves it RUNNING, run(),
+        # interact(), evaluate() and stream() raise Stopped then.
+        while True:
+            try:
+                if self.profile is not None or self.trace is not None or self.breakpoints or self.watchpoints:
+                    status = self.execute_instrumented()
+                elif self.budget is not None or self.deadline is not None:
+                    status = self.execute_limited()
+                elif self.jit:
+                    status = self.execute_blocks()
                 else:
-                    self.pc += 3
-            elif self.opcode == Opcode.JUMP_IF_FALSE:
-                a = self.load(1)
-                if not a:
-                    b = self.load(2)
-                    self.pc = b
+                    status = self.interpret()
+                break
+            except Exception as error:
+                if isinstance(error, IndexError) and self.grow():
+                    continue
+                if isinstance(error, OverflowError) and self.widen():
+                    continue
+                if self.trace is not None and not self.trace.live:
+                    self.trace.dump()
+                raise
+        self.status = status
+        return status
+
+    def limit(self, instructions: Optional[int] = None, seconds: Optional[float] = None) -> None:
+        # Bounds the instructions retired and the time taken from now on,
+        # over any number of resume() calls, until limit() is called again.
+        # Going over raises InstructionLimitExceeded or DeadlineExceeded
+        # from resume() and leaves the machine where it was, so it can be
+        # resumed once the limit has been lifted or raised. Limits are only
+        # checked every LIMIT_INTERVAL instructions, at a jump or block
+        # boundary, so a run may go over its budget by the instructions up
+        # to there, and a counting loop the jit runs in one call counts all
+        # of its instructions at once. evaluate() and stream() also stop
+        # waiting for input at the deadline.
+        self.budget = None if instructions is None else self.retired + instructions
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+
+    def check_limits(self) -> None:
+        if self.budget is not None and self.retired >= self.budget:
+            raise InstructionLimitExceeded('Instruction budget used up', self.pc, self.retired)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceeded('Deadline passed', self.pc, self.retired)
+
+    def execute_limited(self) -> Status:
+        # Runs the interpreter or the jit in slices, checking the limits in
+        # between.
+        while True:
+            self.check_limits()
+            until = self.retired + LIMIT_INTERVAL
+            if self.budget is not None:
+                until = min(until, self.budget)
+            if self.jit:
+                status = self.execute_blocks(until)
+            else:
+                status = self.interpret(until - self.retired)
+            if status != RUNNING:
+                return status
+
+    def execute_instrumented(self) -> Status:
+        # Goes through step(), counts every retired instruction in
+        # self.profile, records it in self.trace and calls the breakpoints
+        # and watchpoints it hits. The other paths are not instrumented at
+        # all. A callback that returns True stops the machine, before the
+        # instruction for breakpoints and reads, after it for writes.
+        # Callbacks may change memory through write(). The instruction a
+        # machine stopped or blocked on does not hit its breakpoint or read
+        # watchpoints again when the machine is resumed.
+        profile = self.profile
+        trace = self.trace
+        breakpoints = self.breakpoints
+        watchpoints = self.watchpoints
+        limited = self.budget is not None or self.deadline is not None
+        skip = self.stopped
+        self.stopped = None
+        while True:
+            if limited:
+                self.check_limits()
+            pc = self.pc
+            traced = trace is not None and trace.covers(pc)
+            if traced:
+                opcode, modes, operands, target = self.inspect()
+            if pc != skip and pc in breakpoints and breakpoints[pc](self):
+                self.stopped = pc
+                return RUNNING
+            written = None
+            if watchpoints:
+                read, written = self.accesses()
+                if pc != skip and any(
+                        address in watchpoints and watchpoints[address](self, address, Access.READ)
+                        for address in read):
+                    self.stopped = pc
+                    return RUNNING
+            skip = None
+            status = self.step()
+            if status == BLOCKED:
+                self.stopped = pc
+                return status
+            if profile is not None:
+                profile.record(pc, self.opcode, self.pc)
+            if traced:
+                stored = None if target is None else self.memory[target]
+                trace.append(TraceEntry(pc, opcode, modes, operands, stored))
+            if status == HALTED:
+                return status
+            if written in watchpoints and watchpoints[written](self, written, Access.WRITE):
+                return RUNNING
+
+    def accesses(self) -> Tuple[List[int], Optional[int]]:
+        # The addresses the instruction at pc reads and writes, apart from
+        # its own cells.
+        self.decode()
+        count = PARAMETERS[self.opcode]
+        written = WRITTEN.get(self.opcode)
+        read = [
+            self.pointer(offset) for offset in range(1, count + 1)
+            if offset != written and self.modes[offset - 1] != IMMEDIATE]
+        return read, None if written is None else self.pointer(written)
+
+    def inspect(self) -> Tuple[Opcode, Tuple[Mode, ...], Tuple[int, ...], Optional[int]]:
+        # Decodes the instruction at pc without executing it, giving the
+        # values of its input parameters and the address it writes to.
+        opcode, modes = Instruction.decode(self.memory[self.pc])
+        self.opcode, self.modes = opcode, modes
+        count = PARAMETERS[opcode]
+        written = WRITTEN.get(opcode)
+        operands = tuple(self.load(offset) for offset in range(1, count + 1) if offset != written)
+        target = None if written is None else self.pointer(written)
+        return opcode, modes[:count], operands, target
+
+    def execute_blocks(self, until: int = sys.maxsize) -> Status:
+        # Code that could not be compiled is interpreted up to the next jump,
+        # where a block may start again. This pays off for programs that
+        # spend their time in arithmetic, like the day 2 search, which runs
+        # its whole program as one block, and most for counting loops, which
+        # take one call whatever their count. The other puzzle programs
+        # mostly run short stretches of code between inputs and outputs and
+        # are about as fast, or a little slower, than with interpret().
+        # Returns RUNNING at the first block boundary once retired has
+        # reached until.
+        blocks = self.blocks
+        memory = self.memory
+        while True:
+            if self.retired >= until:
+                return RUNNING
+            block = blocks.get(self.pc)
+            if block is None and self.pc not in blocks:
+                block = self.compile_block(self.pc)
+            if block is not None:
+                self.pc, retired = block(memory, self.code, self.invalidate)
+                self.retired += retired
+                if retired:
+                    continue
+                # it is compiled again from what is there now next time
+                del blocks[self.pc]
+                self.stale.add(self.pc)
+            # nothing compiled here, or the block returned before its first
+            # instruction, a HALT is not worth entering the interpreter for
+            if self.pc >= 0 and memory[self.pc] == 99:
+                self.retired += 1
+                return HALTED
+            status = self.interpret(stop_after=0)
+            if status != RUNNING:
+                return status
+
+    def interpret(self, stop_after: int = sys.maxsize) -> Status:
+        # This is the hot loop of every Intcode puzzle, so operands are
+        # fetched inline instead of through load() and store(). The values 1
+        # and 2 can only be ADD and MULTIPLY with position parameters, all of
+        # the day 2 programs, and are executed without a cache lookup. It
+        # returns RUNNING after the first jump instruction once it ran
+        # stop_after instructions.
+        # Every address is checked for being negative before it is used, a
+        # negative one would silently index a list memory from its end. A
+        # jump to a negative address fails like fetching the instruction
+        # there does on the other memories.
+        memory = self.memory
+        decoded = self.decoded
+        code = self.code
+        inbox = self.inbox
+        outbox = self.outbox
+        pc = self.pc
+        relative_base = self.relative_base
+        retired = 0
+        if pc < 0:
+            raise IndexError('Negative address', pc)
+        try:
+            while True:
+                retired += 1
+                instruction = memory[pc]
+                if instruction == 1:   # ADD, position parameters
+                    a = memory[pc+1]
+                    b = memory[pc+2]
+                    target = memory[pc+3]
+                    if a | b | target < 0:
+                        raise IndexError('Negative address', min(a, b, target))
+                    memory[target] = memory[a] + memory[b]
+                    if target in code:
+                        self.invalidate(target)
+                    pc += 4
+                    continue
+                if instruction == 2:   # MULTIPLY, position parameters
+                    a = memory[pc+1]
+                    b = memory[pc+2]
+                    target = memory[pc+3]
+                    if a | b | target < 0:
+                        raise IndexError('Negative address', min(a, b, target))
+                    memory[target] = memory[a] * memory[b]
+                    if target in code:
+                        self.invalidate(target)
+                    pc += 4
+                    continue
+                try:
+                    opcode, mode_a, mode_b, mode_c = decoded[pc]
+                except KeyError:
+                    opcode, mode_a, mode_b, mode_c = self.cache_instruction(pc)
+                if opcode == 1:    # ADD
+                    a = memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x)
+                    b = memory[pc+2] if mode_b else memory[x] if (x := memory[pc+2]) >= 0 else negative(x)
+                    target = pc+3 if mode_c else memory[pc+3]
+                    if target < 0:
+                        raise IndexError('Negative address', target)
+                    memory[target] = a + b
+                    if target in code:
+                        self.invalidate(target)
+                    pc += 4
+                elif opcode == 2:  # MULTIPLY
+                    a = memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x)
+                    b = memory[pc+2] if mode_b else memory[x] if (x := memory[pc+2]) >= 0 else negative(x)
+                    target = pc+3 if mode_c else memory[pc+3]
+                    if target < 0:
+                        raise IndexError('Negative address', target)
+                    memory[target] = a * b
+                    if target in code:
+                        self.invalidate(target)
+                    pc += 4
+                elif opcode == 5:  # JUMP_IF_TRUE
+                    if memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x):
+                        pc = memory[pc+2] if mode_b else memory[x] if (x := memory[pc+2]) >= 0 else negative(x)
+                        if pc < 0:
+                            # the jump is retired, fetching from pc fails
+                            retired += 1
+                            raise IndexError('Negative address', pc)
+                    else:
+                        pc += 3
+                    if retired >= stop_after:
+                        return RUNNING
+                elif opcode == 6:  # JUMP_IF_FALSE
+                    if memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x):
+                        pc += 3
+                    else:
+                        pc = memory[pc+2] if mode_b else memory[x] if (x := memory[pc+2]) >= 0 else negative(x)
+                        if pc < 0:
+                            retired += 1
+                            raise IndexError('Negative address', pc)
+                    if retired >= stop_after:
+                        return RUNNING
+                elif opcode == 7:  # LESS_THAN
+                    a = memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x)
+                    b = memory[pc+2] if mode_b else memory[x] if (x := memory[pc+2]) >= 0 else negative(x)
+                    target = pc+3 if mode_c else memory[pc+3]
+                    if target < 0:
+                        raise IndexError('Negative address', target)
+                    memory[target] = 1 if a < b else 0
+                    if target in code:
+                        self.invalidate(target)
+                    pc += 4
+                elif opcode == 8:  # EQUALS
+                    a = memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x)
+                    b = memory[pc+2] if mode_b else memory[x] if (x := memory[pc+2]) >= 0 else negative(x)
+                    target = pc+3 if mode_c else memory[pc+3]
+                    if target < 0:
+                        raise IndexError('Negative address', target)
+                    memory[target] = 1 if a == b else 0
+                    if target in code:
+                        self.invalidate(target)
+                    pc += 4
+                elif opcode == 3:  # READ_INPUT
+                    if not inbox:
+                        retired -= 1
+                        return BLOCKED
+                    target = pc+1 if mode_a else memory[pc+1]
+                    if target < 0:
+                        raise IndexError('Negative address', target)
+                    memory[target] = inbox[0]
+                    inbox.popleft()
+                    if target in code:
+                        self.invalidate(target)
+                    pc += 2
+                elif opcode == 4:  # WRITE_OUTPUT
+                    outbox.append(memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x))
+                    pc += 2
+                elif opcode == 9:  # ADJUST_RELATIVE_BASE
+                    relative_base += memory[pc+1] if mode_a else memory[x] if (x := memory[pc+1]) >= 0 else negative(x)
+                    pc += 2
+                elif opcode == 99: # HALT
+                    return HALTED
                 else:
-                    self.pc += 3
-            elif self.opcode == Opcode.LESS_THAN:
-                a = self.load(1)
-                b = self.load(2)
-                c = int(a < b)
-                self.store(3, c)
-                self.pc += 4
-            elif self.opcode == Opcode.EQUALS:
-                a = self.load(1)
-                b = self.load(2)
-                c = int(a == b)
-                self.store(3, c)
-                self.pc += 4
-            elif self.opcode == Opcode.HALT:
-                halt = True
+                    # Some parameter is relative, see cache_instruction().
+                    opcode -= RELATIVE_RECORD
+                    if opcode == 3 and not inbox:
+                        retired -= 1
+                        return BLOCKED
+                    a = pc+1 if mode_a == 1 else memory[pc+1] + (relative_base if mode_a else 0)
+                    if a < 0:
+                        raise IndexError('Negative address', a)
+                    if opcode == 9:
+                        relative_base += memory[a]
+                        pc += 2
+                    elif opcode == 3:
+                        memory[a] = inbox[0]
+                        inbox.popleft()
+                        if a in code:
+                            self.invalidate(a)
+                        pc += 2
+                    elif opcode == 4:
+                        outbox.append(memory[a])
+                        pc += 2
+                    elif opcode == 5 or opcode == 6:
+                        if bool(memory[a]) == (opcode == 5):
+                            b = pc+2 if mode_b == 1 else memory[pc+2] + (relative_base if mode_b else 0)
+                            if b < 0:
+                                raise IndexError('Negative address', b)
+                            pc = memory[b]
+                            if pc < 0:
+                                retired += 1
+                                raise IndexError('Negative address', pc)
+                        else:
+                            pc += 3
+                        if retired >= stop_after:
+                            return RUNNING
+                    else:
+                        b = pc+2 if mode_b == 1 else memory[pc+2] + (relative_base if mode_b else 0)
+                        c = pc+3 if mode_c == 1 else memory[pc+3] + (relative_base if mode_c else 0)
+                        if b | c < 0:
+                            raise IndexError('Negative address', min(b, c))
+                        if opcode == 1:
+                            memory[c] = memory[a] + memory[b]
+                        elif opcode == 2:
+                            memory[c] = memory[a] * memory[b]
+                        elif opcode == 7:
+                            memory[c] = 1 if memory[a] < memory[b] else 0
+                        else:
+                            memory[c] = 1 if memory[a] == memory[b] else 0
+                        if c in code:
+                            self.invalidate(c)
+                        pc += 4
+        except (IndexError, OverflowError):
+            # the instruction is retried after the memory has grown, or
+            # become a list
+            retired -= 1
+            raise
+        finally:
+            self.pc = pc
+            self.relative_base = relative_base
+            self.retired += retired
+
+    def run(self, input=None) -> List[int]:
+        self.pc = 0
+        self.relative_base = 0
+        self.stopped = None
+        if input:
+            self.inbox.extend(input)
+        # Runs that are profiled, traced or debugged have to execute, and
+        # only list memory is cheap enough to hash.
+        if (self.cache is not None and isinstance(self.memory, (list, array))
+                and self.profile is None and self.trace is None and not self.breakpoints and not self.watchpoints):
+            status = self.run_cached()
+        else:
+            status = self.resume()
+        output = list(self.outbox)
+        self.outbox.clear()
+        if status == BLOCKED:
+            raise InputRequired(self.pc, output)
+        if status == RUNNING:
+            raise Stopped(self.pc, output)
+        return output
+
+    def evaluate_many(self, inputs: Iterable[Sequence[int]]) -> Iterator[List[int]]:
+        # Runs the loaded program from its image once for every input
+        # sequence and yields the outputs of each run. The machine and its
+        # caches are reused, reset() puts memory back with one slice
+        # assignment, so runs cost no allocation beyond their outputs.
+        # Inputs are only taken when the previous outputs have been
+        # consumed, and may depend on them.
+        for input in inputs:
+            self.reset()
+            yield self.run(input)
+
+    def run_cached(self) -> Status:
+        # Only runs that halt are stored, a blocked one is left to continue
+        # as usual. A hit leaves the machine as the stored run ended, except
+        # that retired does not count the instructions it skipped.
+        key = self.cache.key(self.memory, self.inbox)
+        result = self.cache.get(key)
+        if result is None:
+            inputs, outputs = len(self.inbox), len(self.outbox)
+            status = self.resume()
+            if status == HALTED:
+                self.cache.put(key, Result(
+                    list(self.outbox)[outputs:], list(self.memory), self.pc, self.relative_base,
+                    inputs - len(self.inbox)))
+            return status
+        for address in list(self.code):
+            if address >= len(result.memory) or self.memory[address] != result.memory[address]:
+                self.invalidate(address)
+        if isinstance(self.memory, array):
+            cells = int64_cells(result.memory)
+            self.memory = result.memory if cells is None else cells
+        else:
+            self.memory[:] = result.memory
+        self.pc = result.pc
+        self.relative_base = result.relative_base
+        for _ in range(result.consumed):
+            self.inbox.popleft()
+        self.outbox.extend(result.outputs)
+        self.status = HALTED
+        return HALTED
+
+    def interact(self, read: Callable[[], int], write: Callable[[int], None]) -> None:
+        self.pc = 0
+        self.relative_base = 0
+        self.stopped = None
+        while True:
+            status = self.resume()
+            while self.outbox:
+                write(self.outbox.popleft())
+            if status == HALTED:
+                break
+            if status == RUNNING:
+                raise Stopped(self.pc, [])
+            self.inbox.append(read())
+
+    async def evaluate(self, input=None) -> None:
+        # Reads from self.input and writes to self.output. Only the values
+        # the program reads are taken from the input queue, one whenever it
+        # blocks, so machines may share an input queue and values left when
+        # it halts stay queued.
+        self.pc = 0
+        self.relative_base = 0
+        self.stopped = None
+        if input:
+            for item in input:
+                if self.input.full():
+                    await self.input.put(item)
+                else:
+                    self.input.put_nowait(item)
+        while True:
+            status = self.resume()
+            await self.flush()
+            if status == Status.HALTED:
+                break
+            if status == RUNNING:
+                raise Stopped(self.pc, [])
+            self.inbox.append(await self.receive())
+
+    async def stream(self, input: Union[Iterable[int], AsyncIterable[int], None] = None) -> AsyncIterator[int]:
+        # Runs the program from the start and yields its outputs, for use
+        # with async for. Inputs are taken from input one at a time, when
+        # the program needs them, so they may depend on what it yielded.
+        # Without input it reads self.input like evaluate(). Runs out of
+        # input with InputRequired. Outputs are yielded straight from the
+        # outbox, without a queue in between.
+        self.pc = 0
+        self.relative_base = 0
+        self.stopped = None
+        if input is None:
+            values = None
+        elif isinstance(input, AsyncIterable):
+            values = aiter(input)
+        else:
+            values = iter(input)
+        while True:
+            status = self.resume()
+            while self.outbox:
+                yield self.outbox.popleft()
+            if status == HALTED:
+                return
+            if status == RUNNING:
+                raise Stopped(self.pc, [])
+            if values is None:
+                self.inbox.append(await self.receive())
+                continue
+            try:
+                if isinstance(values, AsyncIterator):
+                    self.inbox.append(await anext(values))
+                else:
+                    self.inbox.append(next(values))
+            except (StopIteration, StopAsyncIteration):
+                raise InputRequired(self.pc, []) from None
+
+    async def receive(self) -> int:
+        # The next value from the input queue, waiting no longer than the
+        # deadline.
+        if self.deadline is None:
+            return await self.input.get()
+        try:
+            return await asyncio.wait_for(self.input.get(), max(0, self.deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded('Deadline passed waiting for input', self.pc, self.retired) from None
+
+    async def flush(self) -> None:
+        # Moves the outbox to the output queue. Queue.put() is a coroutine
+        # call for every value even when there is room, so it is only used
+        # to wait while the queue is full.
+        outbox = self.outbox
+        output = self.output
+        while outbox:
+            if output.full():
+                await output.put(outbox.popleft())
             else:
-                raise ValueError('Unknown opcode', self.opcode)
+                output.put_nowait(outbox.popleft())
@@ -1,4 +1,13 @@
-from .computer import IntComputer, Opcode, Mode
+from .computer import (
+    Access, DeadlineExceeded, IntComputer, InputRequired, InstructionLimitExceeded, Opcode, Mode, Status, Stopped)
+from .memory import Overlay, PagedMemory, SharedImage, PAGE_SIZE
+from .trace import Trace, TraceEntry
+from .utils import read_csv_input
+
+import asyncio
+from array import array
+import io
+import itertools
 
 import pytest
 
@@ -11,8 +20,9 @@ import pytest
         ([2,4,4,5,99,0], [2,4,4,5,99,9801]),
         ([1,1,1,4,99,5,6,0,99], [30,1,1,4,2,5,6,0,99])
     ])
-async def test_evaluate(initial_state, expected_halt_state):
-    computer = IntComputer()
+@pytest.mark.parametrize('jit', [False, True])
+async def test_evaluate(initial_state, expected_halt_state, jit):
+    computer = IntComputer(jit=jit)
     computer.load_program(initial_state)
     await computer.evaluate()
     halt_state = computer.memory
@@ -29,4 +39,678 @@ def test_decode(instruction, opcode, modes):
     instance.load_program([instruction, 1, 1, 0])
     instance.decode()
     assert instance.opcode == opcode
-    assert instance.modes == modes
\ No newline at end of file
+    assert instance.modes == modes
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('jit', [False, True])
+async def test_evaluate_self_modifying_program(jit):
+    # the instruction at address 0 runs as ADD, the program then rewrites it
+    # to a MULTIPLY and jumps back, so a stale decode would output 5 twice
+    program = [
+        1101,2,3,21, 4,21, 1005,22,20, 1101,1,0,22,
+        1101,1102,0,0, 1105,1,0, 99, 0, 0]
+    computer = IntComputer(program=program, jit=jit)
+    await computer.evaluate()
+    outputs = [computer.output.get_nowait() for _ in range(computer.output.qsize())]
+    assert outputs == [5, 6]
+    if not jit:
+        assert computer.decoded[0] == (Opcode.MULTIPLY, Mode.IMMEDIATE, Mode.IMMEDIATE, Mode.POSITION)
+
+@pytest.mark.asyncio
+async def test_jit_block_rewriting_itself():
+    # the first ADD patches the second parameter of the next ADD, which
+    # therefore has to run from a new block
+    program = [1101,5,0,6, 1101,1,0,11, 4,11, 99, 0]
+    computer = IntComputer(program=program, jit=True)
+    await computer.evaluate()
+    assert computer.output.get_nowait() == 6
+    assert computer.blocks[0] is not None
+    assert computer.blocks[4] is not None
+
+def test_jit_reads_patched_parameters():
+    # like day 2, the first instruction gets a new parameter before each run,
+    # which the block reads from memory once it has been patched
+    program = [1,0,10,11, 99, 0,0,0,0,0, 5, 0]
+    computer = IntComputer(program=program, jit=True)
+    interpreted = IntComputer(program=program)
+    for noun in range(5):
+        for machine in (computer, interpreted):
+            machine.reset()
+            machine.write(1, noun)
+            machine.run()
+        assert computer.memory == interpreted.memory
+    assert computer.compilations[0] == 2 and computer.blocks[0] is not None
+    assert 1 not in computer.code
+
+def test_jit_gives_up_on_patched_code():
+    program = [1,10,10,11, 99, 0,0,0,0,0, 5, 0]
+    computer = IntComputer(program=program, jit=True)
+    for opcode in (2, 7, 2, 7, 2):
+        computer.reset()
+        computer.write(0, opcode)
+        computer.run()
+    assert computer.compilations[0] == 5
+    assert computer.compile_block(0) is None
+    assert computer.memory[11] == 25
+
+def test_jit_does_not_share_giving_up():
+    program = [1,10,10,11, 99, 0,0,0,0,0, 7, 0]
+    first = IntComputer(program=program, jit=True)
+    for opcode in (2, 7, 2, 7, 2):
+        first.reset()
+        first.write(0, opcode)
+        first.run()
+    # then also on the unpatched image
+    first.reset()
+    first.run()
+    assert first.blocks[0] is None
+    second = IntComputer(program=program, jit=True)
+    assert 0 not in second.blocks
+    second.run()
+    assert second.blocks[0] is not None and second.memory == first.memory
+
+def test_jit_block_writing_its_own_parameters():
+    # the first ADD makes itself write into the opcode of the second one,
+    # which turns it into an output on the next iteration of the loop
+    program = [1101,0,4,3, 1101,0,99,12, 1105,1,0, 99, 0]
+    interpreted = IntComputer(program=program)
+    compiled = IntComputer(program=program, jit=True)
+    assert compiled.run() == interpreted.run() == [1101]
+    assert compiled.memory == interpreted.memory and compiled.retired == interpreted.retired
+    assert compiled.compilations[0] == 1 and 3 not in compiled.code
+
+def test_jit_block_writing_its_own_code():
+    # the second ADD turns the first one into a HALT, which the block finds
+    # when the jump brings it back there
+    program = [1101,7,0,12, 1101,99,0,0, 1105,1,0, 99, 0]
+    interpreted = IntComputer(program=program)
+    compiled = IntComputer(program=program, jit=True)
+    for _ in range(2):
+        interpreted.reset()
+        compiled.reset()
+        assert compiled.run() == interpreted.run() == []
+        assert compiled.memory == interpreted.memory and compiled.retired == interpreted.retired
+    assert compiled.compilations == {0: 1} and 0 not in compiled.code
+
+def counting_program(jump, comparison, counter_first, flag_first, step, start, bound, in_cells):
+    # A loop at 0 that adds step to a counter and compares it with bound,
+    # or jumps on the counter itself without a comparison, then outputs
+    # the counter and the flag.
+    counter, flag, step_cell, bound_cell = 40, 41, 42, 43
+    if in_cells:
+        add = [1, counter, step_cell, counter]
+    else:
+        add = [1001, counter, step, counter]
+    if comparison is None:
+        body = add
+    else:
+        if in_cells:
+            compare = [comparison, *((counter, bound_cell) if counter_first else (bound_cell, counter)), flag]
+        elif counter_first:
+            compare = [comparison + 1000, counter, bound, flag]
+        else:
+            compare = [comparison + 100, bound, counter, flag]
+        body = compare + add if flag_first else add + compare
+    program = body + [jump + 1000, counter if comparison is None else flag, 0, 4, counter, 4, flag, 99]
+    program += [0] * (counter - len(program)) + [start, 0, step, bound]
+    return program
+
+def exits(jump, comparison, counter_first, flag_first, step, start, bound):
+    # whether the loop counting_program() builds gets out within 1000 iterations
+    compare = {7: lambda a, b: a < b, 8: lambda a, b: a == b}.get(comparison)
+    counter = start
+    for _ in range(1000):
+        if flag_first:
+            flag = compare(*((counter, bound) if counter_first else (bound, counter)))
+        counter += step
+        if comparison is None:
+            condition = counter
+        elif not flag_first:
+            condition = compare(*((counter, bound) if counter_first else (bound, counter)))
+        else:
+            condition = flag
+        if bool(condition) != (jump == 5):
+            return True
+    return False
+
+LOOPS = [
+    loop for loop in itertools.product(
+        (5, 6), (7, 8, None), (True, False), (True, False), (1, -1, 3, -3), (0, 5, -7), (9, -9, 0))
+    if (loop[1] is not None or (loop[2] and not loop[3])) and exits(*loop)]
+
+@pytest.mark.parametrize('in_cells', [False, True])
+def test_jit_counting_loops(in_cells):
+    assert len(LOOPS) > 100
+    for loop in LOOPS:
+        program = counting_program(*loop, in_cells)
+        interpreted = IntComputer(program=program)
+        compiled = IntComputer(program=program, jit=True)
+        assert compiled.run() == interpreted.run(), loop
+        assert compiled.memory == interpreted.memory and compiled.retired == interpreted.retired, loop
+
+def test_jit_counting_loop_in_closed_form():
+    # would take hours one iteration at a time
+    program = counting_program(5, 7, True, False, 3, 0, 10**12, False)
+    computer = IntComputer(program=program, jit=True)
+    assert computer.run() == [10**12 + 2, 0]
+    assert computer.retired == 3 * (10**12 + 2) // 3 + 3
+    # a loop that never exits keeps running one iteration at a time
+    program = counting_program(6, 8, True, False, 2, 0, 5, False)
+    computer = IntComputer(program=program, jit=True)
+    computer.blocks[0] = computer.compile_block(0)
+    assert computer.blocks[0](computer.memory, computer.code, computer.invalidate) == (0, 3)
+    assert computer.memory[40] == 2
+
+def test_jit_shares_blocks_between_machines():
+    program = read_csv_input('d05input')[0]
+    first = IntComputer(program=program, jit=True)
+    assert first.run([5]) == [9386583]
+    second = IntComputer(program=program, jit=True)
+    assert second.run([5]) == [9386583]
+    assert second.compilations == {}
+    started = [start for start, block in first.blocks.items() if block is not None]
+    assert started and all(second.blocks[start] is first.blocks[start] for start in started)
+    # a block that writes into its own parameters reads them from memory
+    computer = IntComputer(program=[1,0,0,3, 1,3,3,7, 99], jit=True)
+    assert computer.compile_block(0) is not None
+    computer.run()
+    assert computer.memory == [1,0,0,2, 1,3,3,4, 99] and 3 not in computer.code and 7 not in computer.code
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('input_value, expected', [(7, 999), (8, 1000), (9, 1001)])
+async def test_jit_compare_and_jump(input_value, expected):
+    program = [
+        3,21,1008,21,8,20,1005,20,22,107,8,21,20,1006,20,31,
+        1106,0,36,98,0,0,1002,21,125,20,4,20,1105,1,46,104,
+        999,1105,1,46,1101,1000,1,20,4,20,1105,1,46,98,99]
+    computer = IntComputer(program=program, jit=True)
+    await computer.evaluate([input_value])
+    assert computer.output.get_nowait() == expected
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('system_id, expected', [(1, 16489636), (5, 9386583)])
+async def test_jit_diagnostics(system_id, expected):
+    program = read_csv_input('d05input')[0]
+    computer = IntComputer(program=program, jit=True)
+    await computer.evaluate([system_id])
+    outputs = [computer.output.get_nowait() for _ in range(computer.output.qsize())]
+    assert outputs[-1] == expected
+    assert not any(outputs[:-1])
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_run(jit):
+    program = [3,9,8,9,10,9,4,9,99,-1,8]
+    computer = IntComputer(program=program, jit=jit)
+    assert computer.run([8]) == [1]
+    assert computer.run([7]) == [0]
+
+def test_run_without_enough_input():
+    computer = IntComputer(program=[3,0,4,0,3,0,99])
+    with pytest.raises(InputRequired):
+        computer.run([1])
+
+def test_resume_pauses_on_input_starvation():
+    computer = IntComputer(program=[3,0,4,0,3,0,4,0,99])
+    assert computer.resume() == Status.BLOCKED
+    assert computer.pc == 0
+    computer.inbox.append(5)
+    assert computer.resume() == Status.BLOCKED
+    assert computer.pc == 4
+    computer.inbox.append(6)
+    assert computer.resume() == Status.HALTED
+    assert list(computer.outbox) == [5, 6]
+
+def test_resume_drives_network_without_event_loop():
+    # two machines that add one to every value and pass it on, wired in a
+    # ring and stepped by hand until the first one halts
+    program = [3,12,1001,12,1,12,4,12,1005,12,0,99,0]
+    a = IntComputer(program=program)
+    b = IntComputer(program=program)
+    a.inbox.append(-3)
+    machines = [(a, b), (b, a)]
+    while a.status != Status.HALTED:
+        for machine, successor in machines:
+            machine.resume()
+            successor.inbox.extend(machine.outbox)
+            machine.outbox.clear()
+    assert a.memory[12] == 0
+    assert list(a.inbox) == [1]
+    assert b.status == Status.BLOCKED
+
+def test_interact():
+    inputs = iter([4, 2])
+    outputs = []
+    computer = IntComputer(program=[3,0,4,0,3,0,4,0,99])
+    computer.interact(lambda: next(inputs), outputs.append)
+    assert outputs == [4, 2]
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_reset_restores_program_and_caches(jit):
+    program = [
+        1101,2,3,21, 4,21, 1005,22,20, 1101,1,0,22,
+        1101,1102,0,0, 1105,1,0, 99, 0, 0]
+    computer = IntComputer(program=program, jit=jit)
+    assert computer.run() == [5, 6]
+    computer.reset()
+    assert computer.memory == program
+    assert computer.run() == [5, 6]
+    computer.reset()
+    computer.write(2, 4)
+    assert computer.run() == [6, 8]
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_overlay_keeps_program_image_intact(jit):
+    program = (
+        1101,2,3,21, 4,21, 1005,22,20, 1101,1,0,22,
+        1101,1102,0,0, 1105,1,0, 99, 0, 0)
+    first = IntComputer(program=program, jit=jit, overlay=True)
+    second = IntComputer(program=program, jit=jit, overlay=True)
+    assert first.image is second.image is program
+    assert first.run() == [5, 6]
+    assert list(second.memory) == list(program)
+    assert first.memory.writes == {0: 1102, 21: 6, 22: 1}
+    first.reset()
+    assert first.memory.writes == {}
+    first.write(2, 4)
+    assert first.run() == [6, 8]
+    assert second.run() == [5, 6]
+
+@pytest.mark.parametrize('options', [{}, {'overlay': True}, {'paged': True}, {'jit': True}, {'int64': True}])
+def test_shared_image_program(options):
+    program = (
+        1101,2,3,21, 4,21, 1005,22,20, 1101,1,0,22,
+        1101,1102,0,0, 1105,1,0, 99, 0, 0)
+    with SharedImage.publish(program) as image:
+        computer = IntComputer(program=image.values, **options)
+        assert computer.image is image.values
+        assert computer.run() == [5, 6]
+        computer.reset()
+        computer.write(2, 4)
+        assert computer.run() == [6, 8]
+        assert list(image.values) == list(program)
+        del computer
+
+@pytest.mark.parametrize('options', [{}, {'overlay': True}, {'paged': True}, {'jit': True}, {'int64': True}])
+def test_clone(options):
+    # adds up its inputs until it reads 0
+    program = [3,13, 1,13,14,14, 1005,13,0, 4,14, 99, 0, 0, 0]
+    computer = IntComputer(program=program, **options)
+    computer.inbox.extend([1, 2])
+    assert computer.resume() == Status.BLOCKED
+    clone = computer.clone()
+    clone.inbox.extend([10, 0])
+    assert clone.resume() == Status.HALTED and list(clone.outbox) == [13]
+    computer.inbox.append(0)
+    assert computer.resume() == Status.HALTED and list(computer.outbox) == [3]
+
+def test_overlay_bounds():
+    memory = Overlay((1, 2, 3))
+    memory[2] = 7
+    assert list(memory) == [1, 2, 7]
+    assert memory[5] == 0
+    memory[5] = 1
+    assert memory[5] == 1
+    with pytest.raises(IndexError):
+        memory[-1] = 0
+    with pytest.raises(IndexError):
+        memory[-1]
+
+QUINE = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+
+@pytest.mark.parametrize('options', [
+    {}, {'jit': True}, {'debug': True}, {'paged': True}, {'overlay': True}, {'int64': True}])
+def test_relative_base_and_memory_past_the_program(options):
+    assert IntComputer(program=QUINE, **options).run() == QUINE
+    program = [1102,34915192,34915192,7,4,7,99,0]
+    assert IntComputer(program=program, **options).run() == [34915192 * 34915192]
+    assert IntComputer(program=[104,1125899906842624,99], **options).run() == [1125899906842624]
+    # reads the input into a cell far beyond the program, then echoes it
+    program = [109,10**9, 203,7, 204,7, 99]
+    computer = IntComputer(program=program, **options)
+    assert computer.run([5]) == [5]
+    assert computer.memory[10**9 + 7] == 5
+
+@pytest.mark.parametrize('options', [
+    {}, {'jit': True}, {'debug': True}, {'paged': True}, {'overlay': True}, {'int64': True}])
+def test_negative_relative_address(options):
+    with pytest.raises(IndexError):
+        IntComputer(program=[109,-5, 204,0, 99], **options).run()
+    with pytest.raises(IndexError):
+        IntComputer(program=[109,-5, 21101,1,1,0, 99], **options).run()
+
+@pytest.mark.parametrize('options', [
+    {}, {'jit': True}, {'profile': True}, {'paged': True}, {'overlay': True}, {'int64': True}])
+@pytest.mark.parametrize('program', [
+    [4,-1, 99],
+    [1,-1,0,0, 99],
+    [2,0,0,-3, 99],
+    [1001,-2,1,0, 99],
+    [1107,1,2,-1, 99],
+    [3,-1, 99],
+    [9,-1, 99],
+    [1005,-1,0, 99],
+    [1105,1,-4, 99]])
+def test_negative_position_address(options, program):
+    # fails on every engine and memory, without running the instruction
+    computer = IntComputer(program=program, **options)
+    computer.inbox.append(7)
+    with pytest.raises(IndexError):
+        computer.resume()
+    assert computer.memory[0] == program[0] and computer.inbox[0] == 7
+
+@pytest.mark.parametrize('options', [{}, {'jit': True}, {'profile': True}, {'paged': True}])
+def test_jump_to_negative_address(options):
+    computer = IntComputer(program=[1001,9,1,9, 1006,10,-3, 99, 0, 0, 0], **options)
+    with pytest.raises(IndexError):
+        computer.resume()
+    assert (computer.pc, computer.retired) == (-3, 2) and computer.memory[9] == 1
+
+def test_memory_growth():
+    computer = IntComputer(program=[3,100, 4,100, 99])
+    assert computer.run([7]) == [7]
+    assert isinstance(computer.memory, list) and len(computer.memory) == 101
+    computer.reset()
+    assert computer.memory[:5] == [3,100,4,100,99] and computer.memory[100] == 0
+    computer = IntComputer(program=[21101,2,3,2**40, 99])
+    computer.run()
+    assert isinstance(computer.memory, PagedMemory)
+    assert len(computer.memory.pages) == 2
+    computer.reset()
+    assert computer.memory[2**40] == 0 and len(computer.memory.pages) == 1
+
+def test_paged_memory():
+    memory = PagedMemory((1, 2, 3))
+    assert len(memory) == PAGE_SIZE
+    assert memory[2] == 3 and memory[5 * PAGE_SIZE] == 0
+    memory[5 * PAGE_SIZE] = 2 ** 70
+    memory[5 * PAGE_SIZE + 1] = 4
+    assert memory[5 * PAGE_SIZE] == 2 ** 70 and memory[5 * PAGE_SIZE + 1] == 4
+    assert isinstance(memory.pages[5], list) and not isinstance(memory.pages[0], list)
+    assert len(memory) == 6 * PAGE_SIZE
+    with pytest.raises(IndexError):
+        memory[-1]
+    with pytest.raises(IndexError):
+        memory[-1] = 0
+    memory.reset()
+    assert list(memory)[:4] == [1, 2, 3, 0] and memory[5 * PAGE_SIZE] == 0
+
+def test_profile_counting_loop():
+    # counts cell 20 down from 3 to 0
+    program = [1101,0,3,20, 1001,20,-1,20, 1005,20,4, 99]
+    computer = IntComputer(program=program, profile=True)
+    computer.run()
+    profile = computer.profile
+    assert profile.instructions == 8
+    assert profile.opcodes == {Opcode.ADD: 4, Opcode.JUMP_IF_TRUE: 3, Opcode.HALT: 1}
+    assert profile.hot(2) == [(4, 3), (8, 3)]
+    assert profile.taken == {8: 2} and profile.not_taken == {8: 1}
+    assert 'ADD' in profile.report()
+
+@pytest.mark.asyncio
+async def test_profile_after_evaluate():
+    program = read_csv_input('d05input')[0]
+    computer = IntComputer(program=program, profile=True)
+    await computer.evaluate([5])
+    assert computer.output.get_nowait() == IntComputer(program=program).run([5])[0]
+    assert computer.profile.instructions == sum(computer.profile.pcs.values())
+    assert computer.profile.opcodes[Opcode.READ_INPUT] == 1
+
+def test_trace_keeps_the_last_instructions():
+    program = [1101,0,3,20, 1001,20,-1,20, 1005,20,4, 99]
+    trace = Trace(size=3)
+    IntComputer(program=program, trace=trace).run()
+    assert trace.count == 8
+    assert list(trace) == [
+        TraceEntry(4, Opcode.ADD, (Mode.POSITION, Mode.IMMEDIATE, Mode.POSITION), (1, -1), 0),
+        TraceEntry(8, Opcode.JUMP_IF_TRUE, (Mode.POSITION, Mode.IMMEDIATE), (0, 4), None),
+        TraceEntry(11, Opcode.HALT, (), (), None),
+    ]
+    trace = Trace(start=4, end=8)
+    IntComputer(program=program, trace=trace).run()
+    assert [entry.stored for entry in trace] == [2, 1, 0]
+
+def test_debug_prints_a_live_trace(capsys):
+    assert IntComputer(program=[1101,2,3,7, 4,7, 99, 0], debug=True).run() == [5]
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3
+    assert 'ADD' in lines[0] and lines[0].endswith('2 3 -> 5')
+    assert 'WRITE_OUTPUT' in lines[1] and 'HALT' in lines[2]
+
+def test_trace_dumped_on_failure():
+    output = io.StringIO()
+    trace = Trace(size=2, file=output)
+    computer = IntComputer(program=[3,0, 4,0, 1101,1,1,9, 42, 0], trace=trace)
+    with pytest.raises(ValueError):
+        computer.run([7])
+    lines = output.getvalue().splitlines()
+    assert lines[0] == 'last 2 of 3 traced instructions'
+    assert 'WRITE_OUTPUT' in lines[1] and lines[2].endswith('1 1 -> 2')
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_breakpoints(jit):
+    # adds up its inputs until it reads 0
+    program = [3,13, 1,13,14,14, 1005,13,0, 4,14, 99, 0, 0, 0]
+    computer = IntComputer(program=program, jit=jit)
+    hits = []
+    computer.breakpoints[2] = lambda computer: hits.append(computer.memory[13])
+    computer.breakpoints[9] = lambda computer: True
+    computer.inbox.extend([1, 2, 0])
+    assert computer.resume() == Status.RUNNING
+    assert computer.pc == 9 and hits == [1, 2, 0] and not computer.outbox
+    # the breakpoint that stopped the machine lets it continue
+    assert computer.resume() == Status.HALTED and list(computer.outbox) == [3]
+    # a callback changes memory before the output
+    computer.breakpoints[9] = lambda computer: computer.write(14, 100)
+    computer.reset()
+    assert computer.run([4, 0]) == [100]
+    computer.breakpoints.clear()
+    computer.reset()
+    assert computer.run([4, 0]) == [4]
+
+# outputs 2 + 3 without reading any input
+STOPPED = [1101,2,3,9, 4,9, 99, 0,0,0]
+
+def stop_before_output(computer):
+    computer.breakpoints[4] = lambda computer: True
+
+def test_run_stopped():
+    computer = IntComputer(program=STOPPED)
+    stop_before_output(computer)
+    with pytest.raises(Stopped) as stopped:
+        computer.run()
+    assert stopped.value.args == (4, [])
+    assert computer.resume() == Status.HALTED and list(computer.outbox) == [5]
+
+def test_interact_stopped():
+    computer = IntComputer(program=STOPPED)
+    stop_before_output(computer)
+    reads = []
+    with pytest.raises(Stopped):
+        computer.interact(lambda: reads.append(0) or 0, print)
+    assert not reads and not computer.inbox and computer.pc == 4
+
+@pytest.mark.asyncio
+async def test_evaluate_stopped():
+    computer = IntComputer(program=STOPPED)
+    stop_before_output(computer)
+    with pytest.raises(Stopped):
+        await asyncio.wait_for(computer.evaluate(), 1)
+    assert computer.pc == 4 and computer.output.empty()
+
+@pytest.mark.asyncio
+async def test_stream_stopped():
+    computer = IntComputer(program=STOPPED)
+    stop_before_output(computer)
+    with pytest.raises(Stopped):
+        [output async for output in computer.stream([])]
+    assert computer.pc == 4
+
+def test_breakpoint_on_blocked_input():
+    computer = IntComputer(program=[3,5, 4,5, 99, 0])
+    hits = []
+    computer.breakpoints[0] = hits.append
+    assert computer.resume() == Status.BLOCKED
+    computer.inbox.append(7)
+    assert computer.resume() == Status.HALTED
+    assert len(hits) == 1 and list(computer.outbox) == [7]
+    computer.reset()
+    assert computer.run([8]) == [8] and len(hits) == 2
+
+def test_watchpoints():
+    program = [3,13, 1,13,14,14, 1005,13,0, 4,14, 99, 0, 0, 0]
+    computer = IntComputer(program=program)
+    accesses = []
+    computer.watchpoints[14] = lambda computer, address, access: accesses.append((computer.pc, access))
+    assert computer.run([5, 0]) == [5]
+    assert accesses == [
+        (2, Access.READ), (6, Access.WRITE), (2, Access.READ), (6, Access.WRITE), (9, Access.READ)]
+    # stopping on a write leaves the machine after the instruction, on a
+    # read before it
+    computer.reset()
+    computer.watchpoints[14] = lambda computer, address, access: access == Access.WRITE
+    computer.inbox.extend([5, 6, 0])
+    assert computer.resume() == Status.RUNNING and computer.pc == 6 and computer.memory[14] == 5
+    del computer.watchpoints[14]
+    computer.watchpoints[13] = lambda computer, address, access: access == Access.READ and computer.pc == 6
+    assert computer.resume() == Status.RUNNING and computer.pc == 6 and computer.memory[13] == 5
+    assert computer.resume() == Status.RUNNING and computer.pc == 6 and computer.memory[13] == 6
+    computer.watchpoints.clear()
+    assert computer.resume() == Status.HALTED and list(computer.outbox) == [11]
+
+@pytest.mark.parametrize('options', [{}, {'jit': True}, {'overlay': True}, {'paged': True}, {'int64': True}])
+def test_evaluate_many(options):
+    program = read_csv_input('d05input')[0]
+    computer = IntComputer(program=program, **options)
+    outputs = computer.evaluate_many([system_id] for system_id in itertools.cycle((1, 5)))
+    assert [next(outputs)[-1] for _ in range(4)] == [16489636, 9386583] * 2
+    assert list(computer.evaluate_many([])) == []
+    with pytest.raises(InputRequired):
+        list(computer.evaluate_many([[5], []]))
+
+@pytest.mark.asyncio
+async def test_stream():
+    # adds up its inputs until it reads 0, outputting every sum
+    program = [3,15, 1,15,16,16, 4,16, 1005,15,0, 99, 0, 0, 0, 0, 0]
+    computer = IntComputer(program=program)
+    assert [output async for output in computer.stream([1, 2, 3, 0])] == [1, 3, 6, 6]
+
+    async def doubled():
+        for value in (1, 2, 0):
+            yield 2 * value
+    computer = IntComputer(program=program)
+    assert [output async for output in computer.stream(doubled())] == [2, 6, 6]
+    # inputs are only taken when they are needed
+    outputs = []
+    feedback = (outputs[-1] if outputs else 1 for _ in range(3))
+    computer = IntComputer(program=program)
+    async for output in computer.stream(itertools.chain(feedback, [0])):
+        outputs.append(output)
+    assert outputs == [1, 2, 4, 4]
+    with pytest.raises(InputRequired):
+        [output async for output in IntComputer(program=program).stream([1])]
+
+@pytest.mark.asyncio
+async def test_stream_from_queue():
+    # outputs every input until it reads 0
+    program = [3,9, 4,9, 1005,9,0, 99, 0, 0]
+    computer = IntComputer(program=program)
+    for value in (3, 2, 1, 0):
+        computer.input.put_nowait(value)
+    assert [output async for output in computer.stream()] == [3, 2, 1, 0]
+
+@pytest.mark.asyncio
+async def test_evaluate_with_bounded_queues():
+    program = [3,9, 4,9, 1005,9,0, 99, 0, 0]
+    first = IntComputer(program=program, output=asyncio.Queue(maxsize=2))
+    second = IntComputer(program=program, input=first.output)
+    await asyncio.gather(first.evaluate([5, 4, 3, 2, 1, 0]), second.evaluate())
+    outputs = [second.output.get_nowait() for _ in range(second.output.qsize())]
+    assert outputs == [5, 4, 3, 2, 1, 0]
+
+# the instructions a limited run may retire past its budget
+LIMIT_SLACK = 10
+
+# loops forever, counting in cell 8
+RUNAWAY = [1001,8,1,8, 1105,1,0, 99, 0]
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_instruction_limit(jit):
+    computer = IntComputer(program=RUNAWAY, jit=jit)
+    computer.limit(instructions=50_000)
+    with pytest.raises(InstructionLimitExceeded):
+        computer.resume()
+    assert 50_000 <= computer.retired < 50_000 + LIMIT_SLACK
+    counted = computer.memory[8]
+    # the machine can go on under a new limit
+    computer.limit(instructions=1000)
+    with pytest.raises(InstructionLimitExceeded):
+        computer.resume()
+    assert computer.memory[8] > counted
+    computer.limit()
+    computer.write(4, 1106)
+    assert computer.resume() == Status.HALTED
+
+def test_instruction_limit_while_instrumented():
+    computer = IntComputer(program=RUNAWAY, profile=True)
+    computer.limit(instructions=100)
+    with pytest.raises(InstructionLimitExceeded):
+        computer.resume()
+    assert computer.retired == 100 and computer.profile.instructions == 100
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_deadline(jit):
+    computer = IntComputer(program=RUNAWAY, jit=jit)
+    computer.limit(seconds=0.05)
+    with pytest.raises(DeadlineExceeded):
+        computer.resume()
+    assert computer.retired > 0
+
+@pytest.mark.asyncio
+async def test_deadline_while_waiting_for_input():
+    # two machines that both wait for the other first
+    program = [3,9, 4,9, 1105,1,0, 99, 0, 0]
+    first = IntComputer(program=program)
+    second = IntComputer(program=program, input=first.output, output=first.input)
+    for computer in (first, second):
+        computer.limit(seconds=0.05)
+    with pytest.raises(DeadlineExceeded):
+        await asyncio.gather(first.evaluate(), second.evaluate())
+
+def test_int64_memory():
+    # squares cell 14 until it is no longer below 2**62, outputs it
+    program = [2,14,14,14, 1007,14,2**62,15, 1005,15,0, 4,14, 99, 0, 0]
+    computer = IntComputer(program=program, int64=True)
+    assert isinstance(computer.memory, array)
+    computer.write(14, 3)
+    assert computer.resume() == Status.HALTED
+    # the first square that does not fit made the memory a list
+    assert list(computer.outbox) == [3**64] and isinstance(computer.memory, list)
+    computer.reset()
+    assert isinstance(computer.memory, array) and computer.memory[14] == 0
+    computer.write(14, 2**70)
+    assert isinstance(computer.memory, list) and computer.memory[14] == 2**70
+    # the jit needs list memory, paged memory has int64 pages of its own
+    with pytest.raises(ValueError):
+        IntComputer(program=program, int64=True, jit=True)
+
+@pytest.mark.asyncio
+async def test_evaluate_leaves_unread_input_queued():
+    computer = IntComputer(program=[3,5, 4,5, 99, 0])
+    for value in (1, 2, 3):
+        computer.input.put_nowait(value)
+    await computer.evaluate()
+    assert computer.output.get_nowait() == 1
+    assert [computer.input.get_nowait() for _ in range(computer.input.qsize())] == [2, 3]
+
+@pytest.mark.asyncio
+async def test_evaluate_with_a_shared_input_queue():
+    # outputs the sum of the three inputs it reads
+    program = [3,17, 3,18, 1,17,18,17, 3,18, 1,17,18,17, 4,17, 99, 0, 0]
+    shared = asyncio.Queue()
+    for value in range(1, 7):
+        shared.put_nowait(value)
+    first = IntComputer(program=program, input=shared)
+    second = IntComputer(program=program, input=shared)
+    await asyncio.wait_for(asyncio.gather(first.evaluate(), second.evaluate()), 1)
+    assert [first.output.get_nowait(), second.output.get_nowait()] == [6, 15]
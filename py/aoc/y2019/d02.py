@@ -134,48 +134,197 @@ answer would be 1202.)
 
 """
 
+import concurrent.futures
+import multiprocessing
+import os
 import pathlib
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
 
 import pytest
 
+from .batch import BatchComputer
+from .computer import IntComputer
+from .memory import SharedImage
+
 def evaluate(program):
-    state = list(program)
-    pc = 0 # the program counter
-    while True:
-        opcode = state[pc]
-        if opcode == 99:
-            return state
-        # dereference arguments
-        a_ref = state[pc+1]
-        b_ref = state[pc+2]
-        r_ref = state[pc+3]
-        a = state[a_ref]
-        b = state[b_ref]
-        if opcode == 1:   # addition
-            r = a + b
-        elif opcode == 2: # multiplication
-            r = a * b
-        else:
-            raise ValueError(f'invalid opcode: {opcode}')
-        state[r_ref] = r
-        pc += 4
+    computer = IntComputer(program=program)
+    computer.run()
+    return computer.memory
 
-def load_program():
-    input_file = pathlib.Path(__file__).parent / 'd02input'
-    program = [int(d) for d in input_file.read_text().split(',')]
+def make_trial(program):
+    # the jit runs the whole program as one block, reading the noun and verb
+    computer = IntComputer(program=program, jit=True)
     def run(noun, verb):
-        program[1] = noun
-        program[2] = verb
-        state = evaluate(program)
-        return state[0]
+        computer.reset()
+        computer.write(1, noun)
+        computer.write(2, verb)
+        computer.run()
+        return computer.memory[0]
     return run
 
+def read_program():
+    input_file = pathlib.Path(__file__).parent / 'd02input'
+    return [int(d) for d in input_file.read_text().split(',')]
+
+def load_program():
+    return make_trial(read_program())
+
+# State of a search worker process, set up once by the pool initializer.
+# Workers attach to the program published by search() instead of each
+# being sent a copy, and keep it attached until they exit.
+worker_image = None
+worker_trial = None
+worker_found = None
+
+def start_worker(handle, found):
+    global worker_image, worker_trial, worker_found
+    worker_image = SharedImage.attach(handle)
+    worker_trial = make_trial(worker_image.values)
+    worker_found = found
+
+def search_nouns(nouns, verbs, target):
+    for noun in nouns:
+        if worker_found.is_set():
+            return None
+        for verb in verbs:
+            if worker_trial(noun, verb) == target:
+                worker_found.set()
+                return noun, verb
+    return None
+
+def search(
+        program: Sequence[int],
+        target: int,
+        nouns: Sequence[int] = range(100),
+        verbs: Sequence[int] = range(100),
+        workers: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    # Splits the nouns into chunks searched by a pool of worker processes.
+    # The first worker to hit the target tells the others to stop, so when
+    # several pairs match any one of them may be returned.
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, len(nouns) // (workers * 4))
+    found = multiprocessing.Event()
+    with SharedImage.publish(program) as image, concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=start_worker, initargs=(image.handle, found)) as executor:
+        futures = [
+            executor.submit(search_nouns, nouns[start:start + chunk], verbs, target)
+            for start in range(0, len(nouns), chunk)]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if result is not None:
+                found.set()
+                for pending in futures:
+                    pending.cancel()
+                return result
+    return None
+
 def evaluate_noun_and_verb(noun, verb):
     input_file = pathlib.Path(__file__).parent / 'd02input'
     program = [int(d) for d in input_file.read_text().split(',')]
     program[1] = 12
     program[2] = 2
 
+def batch_search(
+        program: Sequence[int],
+        target: int,
+        nouns: Sequence[int] = range(100),
+        verbs: Sequence[int] = range(100)) -> Optional[Tuple[int, int]]:
+    # Tries the whole grid in one vectorized run, one lane per pair.
+    pairs = [(noun, verb) for noun in nouns for verb in verbs]
+    batch = BatchComputer(program, len(pairs))
+    batch.write(1, [noun for noun, _ in pairs])
+    batch.write(2, [verb for _, verb in pairs])
+    batch.run()
+    hits = ((batch.memory[:, 0] == target) & ~batch.faulted).nonzero()[0]
+    return pairs[hits[0]] if len(hits) else None
+
+class NotAffine(Exception):
+    pass
+
+class Linear(NamedTuple):
+    # constant + noun * noun_coefficient + verb * verb_coefficient
+    constant: int
+    noun: int = 0
+    verb: int = 0
+
+def is_constant(value: Optional[Linear]) -> bool:
+    return value is not None and not value.noun and not value.verb
+
+def concrete(value: Optional[Linear]) -> int:
+    if not is_constant(value):
+        raise NotAffine('Value depends on the inputs', value)
+    return value.constant
+
+def symbolic_evaluate(program: Sequence[int]) -> Linear:
+    # Runs an ADD/MULTIPLY program on linear expressions of the noun and verb
+    # and returns the expression left at address 0. Values read through an
+    # input dependent address are unknown (None), which is fine as long as
+    # they are overwritten before use. Raises NotAffine when an unknown or
+    # input dependent value is used as an opcode or a target address, when
+    # the inputs get multiplied together, when address 0 ends up unknown or
+    # when an address is negative. Like IntComputer memory, cells past the
+    # end of the program read as 0.
+    memory: Dict[int, Optional[Linear]] = {address: Linear(value) for address, value in enumerate(program)}
+    memory[1] = Linear(0, 1, 0)
+    memory[2] = Linear(0, 0, 1)
+    zero = Linear(0)
+
+    def address(value: Optional[Linear]) -> int:
+        address = concrete(value)
+        if address < 0:
+            raise NotAffine('Negative address', address)
+        return address
+
+    pc = 0
+    while True:
+        opcode = concrete(memory.get(pc, zero))
+        if opcode == 99:
+            if memory[0] is None:
+                raise NotAffine('Output depends on unknown values')
+            return memory[0]
+        if opcode not in (1, 2):
+            raise NotAffine('Unsupported opcode', opcode)
+        a, b, c = (memory.get(pc + offset, zero) for offset in range(1, 4))
+        x = memory.get(address(a), zero) if is_constant(a) else None
+        y = memory.get(address(b), zero) if is_constant(b) else None
+        target = address(c)
+        if x is None or y is None:
+            memory[target] = None
+        elif opcode == 1:
+            memory[target] = Linear(x.constant + y.constant, x.noun + y.noun, x.verb + y.verb)
+        elif x.noun or x.verb:
+            scale = concrete(y)
+            memory[target] = Linear(x.constant * scale, x.noun * scale, x.verb * scale)
+        else:
+            scale = x.constant
+            memory[target] = Linear(y.constant * scale, y.noun * scale, y.verb * scale)
+        pc += 4
+
+def solve_affine(
+        output: Linear,
+        target: int,
+        nouns: Sequence[int],
+        verbs: Sequence[int]) -> Optional[Tuple[int, int]]:
+    for noun in nouns:
+        remainder = target - output.constant - output.noun * noun
+        if output.verb == 0:
+            if remainder == 0 and verbs:
+                return noun, verbs[0]
+        elif remainder % output.verb == 0 and remainder // output.verb in verbs:
+            return noun, remainder // output.verb
+    return None
+
+def solve(
+        program: Sequence[int],
+        target: int,
+        nouns: Sequence[int] = range(100),
+        verbs: Sequence[int] = range(100)) -> Optional[Tuple[int, int]]:
+    try:
+        output = symbolic_evaluate(program)
+    except NotAffine:
+        return search(program, target, nouns, verbs)
+    return solve_affine(output, target, nouns, verbs)
+
 @pytest.mark.parametrize(
     'initial_state, expected_halt_state',
     [
@@ -188,19 +337,50 @@ def test_evaluate(initial_state, expected_halt_state):
     halt_state = evaluate(initial_state)
     assert halt_state == expected_halt_state
 
+def test_search():
+    assert search(read_program(), 19690720, workers=2) == (64, 21)
+
+def test_search_wide_range():
+    program = [1102,0,0,0,99]
+    assert search(program, 3 * 991, range(1000), range(4, 1000), workers=2) == (3, 991)
+    assert search(program, 211, range(200), range(200), workers=2) is None
+
+def test_batch_search():
+    pytest.importorskip('numpy')
+    assert batch_search(read_program(), 19690720) == (64, 21)
+    assert batch_search([1102,0,0,0,99], 3 * 991, range(10), range(990, 1000)) == (3, 991)
+
+def test_symbolic_evaluate():
+    output = symbolic_evaluate(read_program())
+    assert output.noun * 12 + output.verb * 2 + output.constant == load_program()(12, 2)
+    assert solve(read_program(), 19690720) == (64, 21)
+    assert solve(read_program(), output.constant + output.noun * 1000 + output.verb * 5, range(2000)) == (1000, 5)
+
+def test_solve_falls_back_to_search():
+    program = [1,0,0,3, 2,1,2,0, 99]
+    with pytest.raises(NotAffine):
+        symbolic_evaluate(program)
+    assert solve(program, 49, range(9), range(9)) == (7, 7)
+    assert solve([1,0,0,0,99], 2, range(5), range(5)) == (0, 0)
+
+def test_symbolic_addresses():
+    # reads past the end of the program are 0, writes past it are kept
+    assert symbolic_evaluate([1,0,0,3, 1,200,9,0, 99, 7]) == Linear(7)
+    assert symbolic_evaluate([1,0,0,3, 1,13,13,300, 1,300,300,0, 99, 4]) == Linear(16)
+    assert solve([1,0,0,0, 1,200,0,0, 99], 2, range(3), range(3)) == (0, 0)
+    with pytest.raises(NotAffine):
+        symbolic_evaluate([1,0,0,3, 1,-1,9,0, 99, 7])
+
 def main():
     program = load_program()
     print('1202 output', program(12, 2))
 
     target_output = 19690720
-    import itertools
-    combinations = itertools.product(range(0, 100), range(0, 100))
-    for noun, verb in combinations:
-        output = program(noun, verb)
-        if output == target_output:
-            code = noun * 100 + verb
-            print('Found noun and verb:', code)
-            break
+    result = solve(read_program(), target_output)
+    if result:
+        noun, verb = result
+        code = noun * 100 + verb
+        print('Found noun and verb:', code)
     else:
         print('Noun and verb not found')
 
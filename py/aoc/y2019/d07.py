@@ -1,59 +1,108 @@
-import asyncio
 from itertools import permutations
 
 import pytest
 
 from .computer import IntComputer
+from .network import Network
+from .snapshots import PrefixSnapshots
 from .utils import read_csv_input
 
-async def calculate_amplification(phase_setting, input_signal, program):
-    computer = IntComputer()
-    computer.load_program(program)
-    await computer.evaluate(input=[phase_setting, input_signal])
-    result = await computer.output.get()
-    return result
+def calculate_amplification(phase_setting, input_signal, program, snapshots=None):
+    # With snapshots the amplifier starts out past reading its phase.
+    if snapshots is None:
+        computer = IntComputer(program=program)
+        output = computer.run(input=[phase_setting, input_signal])
+        return output[0]
+    computer = snapshots.start([phase_setting])
+    computer.inbox.append(input_signal)
+    computer.resume()
+    return computer.outbox[0]
 
-async def total_amplification(phase_setting_sequence, program):
+def total_amplification(phase_setting_sequence, program):
+    # One machine runs every amplifier in turn, the inputs are only made
+    # once the previous amplifier produced its signal.
     amplification = 0
-    for phase_setting in phase_setting_sequence:
-        amplification = await calculate_amplification(phase_setting, amplification, program)
+    inputs = ([phase_setting, amplification] for phase_setting in phase_setting_sequence)
+    for output in IntComputer(program=program).evaluate_many(inputs):
+        amplification = output[0]
     return amplification
 
-async def feedback_amplification(phase_setting_sequence, program):
-    a = IntComputer(program=program)
-    b = IntComputer(program=program, input=a.output)
-    c = IntComputer(program=program, input=b.output)
-    d = IntComputer(program=program, input=c.output)
-    e = IntComputer(program=program, input=d.output)
-    a.input = e.output
-    amplifiers = [a, b, c, d, e]
-    for amplifier, phase_setting in zip(amplifiers, phase_setting_sequence):
-        await amplifier.input.put(phase_setting)
-    runs = [amplifier.evaluate() for amplifier in amplifiers]
-    await a.input.put(0)
-    await asyncio.gather(*runs)
-    result = e.output.get_nowait()
-    return result
-
-@pytest.mark.asyncio
-async def test_total_amplification():
+def maximum_amplification(program, phases=range(5), amplifiers=None):
+    # Walks the phase setting sequences one amplifier at a time. Sequences
+    # that used the same phases and produced the same signal so far behave
+    # the same from here on, so only one of them is kept, and every
+    # (phase, signal) pair is run through the program at most once.
+    amplifiers = len(phases) if amplifiers is None else amplifiers
+    if amplifiers > len(phases):
+        raise ValueError(f'{amplifiers} amplifiers need distinct phases, only {len(phases)} given')
+    outputs = {}
+    snapshots = PrefixSnapshots(program)
+    states = {(frozenset(), 0): ()}
+    for _ in range(amplifiers):
+        next_states = {}
+        for (used, signal), sequence in states.items():
+            for phase in phases:
+                if phase in used:
+                    continue
+                if (phase, signal) not in outputs:
+                    outputs[phase, signal] = calculate_amplification(phase, signal, program, snapshots)
+                next_states.setdefault((used | {phase}, outputs[phase, signal]), sequence + (phase,))
+        states = next_states
+    return max((signal, sequence) for (_, signal), sequence in states.items())
+
+def feedback_amplification(phase_setting_sequence, program):
+    network = Network()
+    names = [str(index) for index in range(len(phase_setting_sequence))]
+    for name, phase_setting in zip(names, phase_setting_sequence):
+        network.add(name, IntComputer(program=program), [phase_setting])
+    for source, destination in zip(names, names[1:] + names[:1]):
+        network.connect(source, destination)
+    network.send(names[0], 0)
+    network.run()
+    # the last amplifier's final signal ends up with the halted first one
+    return network.machines[names[0]].computer.inbox[-1]
+
+def test_amplification_from_snapshots():
+    program = read_csv_input('d07input')[0]
+    snapshots = PrefixSnapshots(program)
+    for phase_setting in range(5):
+        for signal in (0, 7, 12345):
+            expected = calculate_amplification(phase_setting, signal, program)
+            assert calculate_amplification(phase_setting, signal, program, snapshots) == expected
+    assert len(snapshots) == 6
+
+def test_total_amplification():
     program = [3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0]
     phase_setting_sequence = [4,3,2,1,0]
-    actual = await total_amplification(phase_setting_sequence, program)
+    actual = total_amplification(phase_setting_sequence, program)
     assert actual == 43210
 
-async def main():
+def test_maximum_amplification():
+    program = [3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0]
+    assert maximum_amplification(program) == (43210, (4,3,2,1,0))
+    assert maximum_amplification(program, range(7)) == (6543210, (6,5,4,3,2,1,0))
+    assert maximum_amplification(program, range(7), 3) == (654, (6,5,4))
+    with pytest.raises(ValueError):
+        maximum_amplification(program, range(3), 4)
+    program = read_csv_input('d07input')[0]
+    expected = max(total_amplification(sequence, program) for sequence in permutations(range(5)))
+    assert maximum_amplification(program)[0] == expected
+
+def test_feedback_amplification():
+    program = [
+        3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,
+        27,4,27,1001,28,-1,28,1005,28,6,99,0,0,5]
+    assert feedback_amplification([9,8,7,6,5], program) == 139629729
+
+def main():
     program = read_csv_input('d07input')[0]
-    maximum = 0
-    for phase_setting_sequence in permutations(range(5)):
-        amplification = await total_amplification(phase_setting_sequence, program)
-        maximum = amplification if amplification > maximum else maximum
+    maximum, _ = maximum_amplification(program)
     print('Maximum amplification', maximum)
     feedback_maximum = 0
     for phase_setting_sequence in permutations([5, 6, 7, 8, 9]):
-        amplification = await feedback_amplification(phase_setting_sequence, program)
+        amplification = feedback_amplification(phase_setting_sequence, program)
         feedback_maximum = amplification if amplification > feedback_maximum else feedback_maximum
     print('Maximum amplification with feedback', feedback_maximum)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    main()
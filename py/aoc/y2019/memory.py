@@ -0,0 +1,196 @@
+from array import array
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import pytest
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+class Overlay:
+    # Intcode memory as private writes over a shared, never modified,
+    # program image. Creating and resetting an overlay costs time
+    # proportional to what was written, not to the size of the image, which
+    # pays off when short runs are made against large programs. Reads go
+    # through Python code, so long runs are faster on a plain list. Cells
+    # past the end of the image read as 0 until written.
+    image: Sequence[int]
+    writes: Dict[int, int]
+
+    def __init__(self, image: Sequence[int]):
+        self.image = image
+        self.writes = {}
+
+    def __getitem__(self, address: int) -> int:
+        try:
+            return self.writes[address]
+        except KeyError:
+            if address < 0:
+                raise IndexError('Negative address', address)
+            return self.image[address] if address < len(self.image) else 0
+
+    def __setitem__(self, address: int, value: int) -> None:
+        if address < 0:
+            raise IndexError('Negative address', address)
+        self.writes[address] = value
+
+    def __len__(self) -> int:
+        return len(self.image)
+
+    def __iter__(self) -> Iterator[int]:
+        for address in range(len(self.image)):
+            yield self[address]
+
+    def reset(self) -> None:
+        self.writes.clear()
+
+    def copy(self) -> 'Overlay':
+        copy = Overlay(self.image)
+        copy.writes.update(self.writes)
+        return copy
+
+Page = Union[array, List[int]]
+
+def int64_cells(values: Sequence[int]) -> Optional[array]:
+    # The values packed into an int64 array, None if one does not fit. A
+    # memoryview of int64 values, like those of a SharedImage, is copied as
+    # bytes.
+    if isinstance(values, memoryview) and values.format == 'q':
+        cells = array('q')
+        cells.frombytes(values.cast('B'))
+        return cells
+    try:
+        return array('q', values)
+    except OverflowError:
+        return None
+
+class PagedMemory:
+    # Sparse Intcode memory made of fixed size pages that are allocated when
+    # first written to, unallocated cells read as 0. Pages are int64 arrays,
+    # a page that gets a value outside of that range is turned into a list
+    # of Python ints. The length is the end of the highest allocated page.
+    image: Sequence[int]
+    pages: Dict[int, Page]
+    extent: int
+
+    def __init__(self, image: Sequence[int], contents: Optional[Sequence[int]] = None):
+        self.image = image
+        self.fill(image if contents is None else contents)
+
+    def fill(self, contents: Sequence[int]) -> None:
+        self.pages = {}
+        self.extent = 0
+        for start in range(0, len(contents), PAGE_SIZE):
+            values = list(contents[start:start + PAGE_SIZE])
+            values.extend([0] * (PAGE_SIZE - len(values)))
+            try:
+                page = array('q', values)
+            except OverflowError:
+                page = values
+            self.pages[start >> PAGE_BITS] = page
+            self.extent = start + PAGE_SIZE
+
+    def __getitem__(self, address: int) -> int:
+        page = self.pages.get(address >> PAGE_BITS)
+        if page is None:
+            if address < 0:
+                raise IndexError('Negative address', address)
+            return 0
+        return page[address & PAGE_MASK]
+
+    def __setitem__(self, address: int, value: int) -> None:
+        number = address >> PAGE_BITS
+        page = self.pages.get(number)
+        if page is None:
+            if address < 0:
+                raise IndexError('Negative address', address)
+            page = self.pages[number] = array('q', bytes(8 * PAGE_SIZE))
+            self.extent = max(self.extent, (number + 1) << PAGE_BITS)
+        try:
+            page[address & PAGE_MASK] = value
+        except OverflowError:
+            page = self.pages[number] = list(page)
+            page[address & PAGE_MASK] = value
+
+    def __len__(self) -> int:
+        return self.extent
+
+    def __iter__(self) -> Iterator[int]:
+        for address in range(self.extent):
+            yield self[address]
+
+    def reset(self) -> None:
+        self.fill(self.image)
+
+    def copy(self) -> 'PagedMemory':
+        copy = PagedMemory.__new__(PagedMemory)
+        copy.image = self.image
+        copy.pages = {number: page[:] for number, page in self.pages.items()}
+        copy.extent = self.extent
+        return copy
+
+class ImageHandle(NamedTuple):
+    # What a process needs to attach to a SharedImage, cheap to pickle.
+    name: str
+    length: int
+
+class SharedImage:
+    # A program image published once into shared memory as packed int64,
+    # so that worker processes attach to it instead of each receiving a
+    # pickled copy. values is a read only memoryview of the cells, an
+    # IntComputer loaded with it copies it into list or paged memory, while
+    # overlay memory reads from it without a copy. Values outside of int64
+    # cannot be published. The image has to be kept, and eventually closed,
+    # for as long as machines use its values. The publishing process
+    # removes the block when it closes the image, attached ones only unmap
+    # it.
+    def __init__(self, memory: shared_memory.SharedMemory, length: int, owner: bool):
+        self.memory = memory
+        self.owner = owner
+        self.handle = ImageHandle(memory.name, length)
+        self.values = memory.buf[:8 * length].cast('q').toreadonly()
+
+    @classmethod
+    def publish(cls, program: Sequence[int]) -> 'SharedImage':
+        cells = array('q', program)
+        memory = shared_memory.SharedMemory(create=True, size=max(1, 8 * len(cells)))
+        memory.buf[:8 * len(cells)] = cells.tobytes()
+        return cls(memory, len(cells), owner=True)
+
+    @classmethod
+    def attach(cls, handle: ImageHandle) -> 'SharedImage':
+        return cls(shared_memory.SharedMemory(handle.name), handle.length, owner=False)
+
+    def close(self) -> None:
+        # Views of the buffer, like the memory of overlays built on values,
+        # have to be released first.
+        self.values.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self) -> 'SharedImage':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+def test_shared_image():
+    program = [1, -2, 2**40, 99]
+    with SharedImage.publish(program) as image:
+        attached = SharedImage.attach(image.handle)
+        assert list(attached.values) == program
+        overlay = Overlay(attached.values)
+        overlay[1] = 5
+        assert list(overlay) == [1, 5, 2**40, 99] and image.values[1] == -2
+        del overlay
+        attached.close()
+    with pytest.raises(OverflowError):
+        SharedImage.publish([2**63])
+
+def test_int64_cells():
+    assert int64_cells([1, -2**63, 2**63 - 1]) == array('q', [1, -2**63, 2**63 - 1])
+    assert int64_cells((1, 2**63)) is None
+    with SharedImage.publish([3, -4, 2**40]) as image:
+        assert int64_cells(image.values).tolist() == [3, -4, 2**40]
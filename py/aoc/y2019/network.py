@@ -0,0 +1,177 @@
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, Iterable, List, Optional
+
+from .computer import IntComputer, Status, RUNNING, BLOCKED, HALTED
+
+class Backpressure(IntEnum):
+    BLOCK = 0   # the producer waits until there is room
+    DROP = 1    # values that do not fit are dropped
+
+@dataclass
+class Telemetry:
+    instructions: int = 0
+    resumes: int = 0
+    blocked_seconds: float = 0.0
+    peak_depth: int = 0
+    dropped: int = 0
+
+@dataclass
+class Machine:
+    name: str
+    computer: IntComputer
+    capacity: Optional[int]
+    destinations: List['Machine'] = field(default_factory=list)
+    sources: List['Machine'] = field(default_factory=list)
+    telemetry: Telemetry = field(default_factory=Telemetry)
+    blocked_since: Optional[float] = None
+    queued: bool = False
+
+    @property
+    def runnable(self) -> bool:
+        # Machines with undelivered output wait for their destinations, the
+        # output of machines without any is left for the caller.
+        status = self.computer.status
+        if status == HALTED or (self.computer.outbox and self.destinations):
+            return False
+        return status == RUNNING or bool(self.computer.inbox)
+
+    def has_room(self) -> bool:
+        return self.capacity is None or len(self.computer.inbox) < self.capacity
+
+class Network:
+    # Runs many IntComputers wired into any topology. Every output of a
+    # machine goes to all of its destinations, and a machine's inbox is its
+    # input channel, bounded by its capacity. Only machines that have input
+    # to consume, or have not blocked yet, are resumed. With BLOCK a machine
+    # whose output does not fit keeps it in its outbox and is not resumed
+    # until every destination has taken it, so what a machine holds on to is
+    # bounded by what it writes between two reads.
+    machines: Dict[str, Machine]
+
+    def __init__(self, capacity: Optional[int] = None, backpressure: Backpressure = Backpressure.BLOCK):
+        self.capacity = capacity
+        self.backpressure = backpressure
+        self.machines = {}
+        self.ready: Deque[Machine] = deque()
+
+    def add(
+            self, name: str, computer: IntComputer, input: Iterable[int] = (),
+            capacity: Optional[int] = None) -> Machine:
+        machine = Machine(name, computer, self.capacity if capacity is None else capacity)
+        computer.inbox.extend(input)
+        self.machines[name] = machine
+        self.schedule(machine)
+        return machine
+
+    def connect(self, source: str, *destinations: str) -> None:
+        for destination in destinations:
+            self.machines[source].destinations.append(self.machines[destination])
+            self.machines[destination].sources.append(self.machines[source])
+
+    def send(self, name: str, *values: int) -> None:
+        machine = self.machines[name]
+        machine.computer.inbox.extend(values)
+        self.measure_depth(machine)
+        self.schedule(machine)
+
+    def schedule(self, machine: Machine) -> None:
+        if machine.runnable and not machine.queued:
+            machine.queued = True
+            self.ready.append(machine)
+
+    def measure_depth(self, machine: Machine) -> None:
+        depth = len(machine.computer.inbox)
+        if depth > machine.telemetry.peak_depth:
+            machine.telemetry.peak_depth = depth
+
+    def deliver(self, machine: Machine) -> None:
+        outbox = machine.computer.outbox
+        destinations = machine.destinations
+        while outbox and destinations:
+            if self.backpressure == Backpressure.BLOCK:
+                if not all(destination.has_room() for destination in destinations):
+                    return
+            value = outbox.popleft()
+            for destination in destinations:
+                if destination.has_room():
+                    destination.computer.inbox.append(value)
+                    self.measure_depth(destination)
+                else:
+                    destination.telemetry.dropped += 1
+
+    def run(self) -> Dict[str, Status]:
+        # Runs until no machine can make progress, and returns the status of
+        # every machine. Machines still blocked at that point are waiting
+        # for input that nothing is going to send.
+        ready = self.ready
+        while ready:
+            machine = ready.popleft()
+            machine.queued = False
+            if not machine.runnable:
+                continue
+            computer = machine.computer
+            telemetry = machine.telemetry
+            if machine.blocked_since is not None:
+                telemetry.blocked_seconds += time.perf_counter() - machine.blocked_since
+                machine.blocked_since = None
+            retired = computer.retired
+            status = computer.resume()
+            telemetry.instructions += computer.retired - retired
+            telemetry.resumes += 1
+            if status == BLOCKED:
+                machine.blocked_since = time.perf_counter()
+            self.deliver(machine)
+            for destination in machine.destinations:
+                self.schedule(destination)
+            # Reading input may have made room for stalled producers.
+            for source in machine.sources:
+                if source.computer.outbox:
+                    self.deliver(source)
+                    self.schedule(source)
+            self.schedule(machine)
+        return {name: machine.computer.status for name, machine in self.machines.items()}
+
+    def telemetry(self) -> Dict[str, Telemetry]:
+        return {name: machine.telemetry for name, machine in self.machines.items()}
+
+# Both read into a data cell past their code.
+ECHO = [3,7, 4,7, 1105,1,0, 0]
+DOUBLE = [3,11, 102,2,11,11, 4,11, 1105,1,0, 0]
+BURST = [104,1, 104,2, 104,3, 104,4, 99]
+
+def test_fan_out_and_fan_in():
+    network = Network()
+    network.add('source', IntComputer(program=ECHO), [1, 2])
+    network.add('echo', IntComputer(program=ECHO))
+    network.add('double', IntComputer(program=DOUBLE))
+    network.add('sink', IntComputer(program=ECHO))
+    network.connect('source', 'echo', 'double')
+    network.connect('echo', 'sink')
+    network.connect('double', 'sink')
+    assert network.run() == {name: Status.BLOCKED for name in network.machines}
+    assert sorted(network.machines['sink'].computer.outbox) == [1, 2, 2, 4]
+    telemetry = network.telemetry()
+    assert telemetry['source'].instructions == 6
+    assert telemetry['sink'].instructions == 12
+    network.send('source', 3)
+    network.run()
+    assert sorted(network.machines['sink'].computer.outbox) == [1, 2, 2, 3, 4, 6]
+
+def test_backpressure():
+    network = Network(capacity=2)
+    network.add('burst', IntComputer(program=BURST))
+    network.add('sink', IntComputer(program=ECHO))
+    network.connect('burst', 'sink')
+    network.run()
+    assert list(network.machines['sink'].computer.outbox) == [1, 2, 3, 4]
+    assert network.telemetry()['sink'].peak_depth == 2
+    network = Network(capacity=2, backpressure=Backpressure.DROP)
+    network.add('burst', IntComputer(program=BURST))
+    network.add('sink', IntComputer(program=ECHO))
+    network.connect('burst', 'sink')
+    network.run()
+    assert list(network.machines['sink'].computer.outbox) == [1, 2]
+    assert network.telemetry()['sink'].dropped == 2
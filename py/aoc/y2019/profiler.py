@@ -0,0 +1,41 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Tuple
+
+if TYPE_CHECKING:
+    from .computer import Opcode
+
+@dataclass
+class Profile:
+    # Counts collected by IntComputer(profile=True), they add up over every
+    # resume() until the profile is replaced. Instructions that block on
+    # input are counted once they complete. A jump to the very next
+    # instruction counts as not taken.
+    instructions: int = 0
+    opcodes: Counter = field(default_factory=Counter)
+    pcs: Counter = field(default_factory=Counter)
+    taken: Counter = field(default_factory=Counter)
+    not_taken: Counter = field(default_factory=Counter)
+
+    def record(self, pc: int, opcode: 'Opcode', next_pc: int) -> None:
+        self.instructions += 1
+        self.opcodes[opcode] += 1
+        self.pcs[pc] += 1
+        if opcode == 5 or opcode == 6:  # JUMP_IF_TRUE, JUMP_IF_FALSE
+            if next_pc == pc + 3:
+                self.not_taken[pc] += 1
+            else:
+                self.taken[pc] += 1
+
+    def hot(self, count: int = 10) -> List[Tuple[int, int]]:
+        return self.pcs.most_common(count)
+
+    def report(self, count: int = 10) -> str:
+        lines = [f'{self.instructions} instructions']
+        for opcode, hits in self.opcodes.most_common():
+            lines.append(f'{opcode.name:<22}{hits:>10}')
+        for pc, hits in self.hot(count):
+            lines.append(f'pc {pc:<19}{hits:>10}')
+        for pc in sorted(self.taken.keys() | self.not_taken.keys()):
+            lines.append(f'jump {pc:<17}{self.taken[pc]:>10} taken {self.not_taken[pc]:>10} not taken')
+        return '\n'.join(lines)
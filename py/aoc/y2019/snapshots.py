@@ -0,0 +1,74 @@
+from typing import Dict, Sequence, Tuple
+
+from .computer import IntComputer, BLOCKED, HALTED
+from .utils import read_csv_input
+
+class PrefixSnapshots:
+    # Machines that ran a program on known leading inputs, up to the first
+    # input they were not given, kept per input prefix. Programs that read
+    # a setting first and then the data, like the day 7 amplifiers, run the
+    # code that only depends on the setting once per setting instead of
+    # once per run. A prefix is run on a clone of the snapshot of the prefix
+    # one input shorter, so the code before every input is run once for
+    # all prefixes sharing it. Outputs written while running a prefix are
+    # left in the outbox of its snapshot, and of the machines started from
+    # it.
+    snapshots: Dict[Tuple[int, ...], IntComputer]
+
+    def __init__(self, program: Sequence[int], **options):
+        self.program = program
+        self.options = options
+        self.snapshots = {}
+
+    def snapshot(self, prefix: Sequence[int]) -> IntComputer:
+        # The cached machine itself, which must not be resumed.
+        prefix = tuple(prefix)
+        snapshot = self.snapshots.get(prefix)
+        if snapshot is not None:
+            return snapshot
+        if prefix:
+            snapshot = self.snapshot(prefix[:-1]).clone()
+            snapshot.inbox.append(prefix[-1])
+        else:
+            snapshot = IntComputer(program=self.program, **self.options)
+        if snapshot.status != HALTED:
+            snapshot.resume()
+        self.snapshots[prefix] = snapshot
+        return snapshot
+
+    def start(self, prefix: Sequence[int]) -> IntComputer:
+        # A machine ready to be given the inputs that follow prefix and
+        # resumed.
+        return self.snapshot(prefix).clone()
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+def test_snapshots():
+    # adds the two inputs it reads, after counting to 100
+    program = [
+        1001,22,1,22, 1007,22,100,23, 1005,23,0,
+        3,24, 3,25, 1,24,25,26, 4,26, 99, 0,0,0,0,0]
+    snapshots = PrefixSnapshots(program)
+    snapshot = snapshots.snapshot([3])
+    assert snapshot.status == BLOCKED and snapshot.pc == 13
+    retired = snapshot.retired
+    for value in range(5):
+        computer = snapshots.start([3])
+        computer.inbox.append(value)
+        assert computer.resume() == HALTED
+        assert list(computer.outbox) == [3 + value]
+        assert computer.retired == retired + 4
+    assert snapshot.status == BLOCKED and not snapshot.outbox
+    assert len(snapshots) == 2
+    assert list(snapshots.start([1, 2]).outbox) == [3]
+    assert snapshots.snapshot([1, 2, 3]).inbox[-1] == 3
+
+def test_snapshots_of_every_engine():
+    program = read_csv_input('d07input')[0]
+    expected = IntComputer(program=program).run([3, 7])
+    for options in ({'jit': True}, {'overlay': True}, {'paged': True}):
+        computer = PrefixSnapshots(program, **options).start([3])
+        computer.inbox.append(7)
+        computer.resume()
+        assert list(computer.outbox) == expected
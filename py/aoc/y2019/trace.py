@@ -0,0 +1,59 @@
+import sys
+from typing import TYPE_CHECKING, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+if TYPE_CHECKING:
+    from .computer import Mode, Opcode
+
+class TraceEntry(NamedTuple):
+    pc: int
+    opcode: 'Opcode'
+    modes: Tuple['Mode', ...]
+    operands: Tuple[int, ...]
+    stored: Optional[int]
+
+    def __str__(self) -> str:
+        modes = ' '.join(mode.name for mode in self.modes)
+        operands = ' '.join(str(operand) for operand in self.operands)
+        stored = '' if self.stored is None else f' -> {self.stored}'
+        return f'{self.pc:>6} {self.opcode.name:<20} {modes:<28} {operands}{stored}'
+
+class Trace:
+    # Keeps the last size instructions executed by an IntComputer with
+    # trace set, optionally only those with start <= pc < end. The buffer is
+    # allocated up front and overwritten in a circle, so tracing a long run
+    # costs a fixed amount of memory. resume() dumps the trace when the
+    # program raises, a live trace prints every entry as it is added
+    # instead.
+    def __init__(
+            self, size: int = 1024, start: int = 0, end: Optional[int] = None,
+            file: Optional[TextIO] = None, live: bool = False):
+        self.buffer: List[Optional[TraceEntry]] = [None] * size
+        self.count = 0
+        self.start = start
+        self.end = end
+        self.file = file
+        self.live = live
+
+    def covers(self, pc: int) -> bool:
+        return self.start <= pc and (self.end is None or pc < self.end)
+
+    def append(self, entry: TraceEntry) -> None:
+        self.buffer[self.count % len(self.buffer)] = entry
+        self.count += 1
+        if self.live:
+            print(entry, file=self.file or sys.stdout)
+
+    def __len__(self) -> int:
+        return min(self.count, len(self.buffer))
+
+    def __iter__(self) -> Iterator[TraceEntry]:
+        # oldest entry first
+        size = len(self.buffer)
+        for index in range(self.count - len(self), self.count):
+            yield self.buffer[index % size]
+
+    def dump(self, file: Optional[TextIO] = None) -> None:
+        file = file or self.file or sys.stderr
+        print(f'last {len(self)} of {self.count} traced instructions', file=file)
+        for entry in self:
+            print(entry, file=file)